@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import OpenAI, BadRequestError, RateLimitError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tk_ai
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    # OpenAI 兼容的 /chat/completions: 按 server.script 依次返回 (状态码, 响应头), 用完后一律 200
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.requests += 1
+            status, headers = self.server.script.pop(0) if self.server.script else (200, {})
+        threading.Event().wait(self.server.delay)
+        if status == 200:
+            payload = {"id": "x", "object": "chat.completion", "created": 0, "model": tk_ai.AI_MODEL,
+                       "choices": [{"index": 0, "message": {"role": "assistant", "content": " ok "}, "finish_reason": "stop"}]}
+        else: payload = {"error": {"message": f"mock {status}", "type": "mock"}}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        for k, v in {"Content-Type": "application/json", "Content-Length": str(len(data)), **headers}.items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args): pass
+
+
+class _DictCache:
+    def __init__(self): self.items = {}
+    def get(self, prompt, model, temp): return self.items.get((prompt, model, temp))
+    def put(self, prompt, model, temp, response): self.items[(prompt, model, temp)] = response
+
+
+@pytest.fixture
+def mock_api():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockHandler)
+    server.script, server.requests, server.delay, server.lock = [], 0, 0.0, threading.Lock()
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    server.client = OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tk_ai.time, "sleep", calls.append)
+    return calls
+
+
+def test_complete_ai_retries_429_and_5xx_honouring_retry_after(mock_api, sleeps):
+    mock_api.script = [(429, {"Retry-After": "7"}), (503, {}), (429, {"Retry-After": "600"})]
+    cache = _DictCache()
+    text = tk_ai.complete_ai(mock_api.client, "p", 1.0, tk_ai.RateLimiter(0), 4, cache)
+    assert text == "ok" and mock_api.requests == 4
+    assert sleeps[0] == 7.0 and 0.5 <= sleeps[1] <= 2.0 and sleeps[2] == 60.0  # 无 Retry-After 走退避, 超长的封顶 60s
+    assert cache.get("p", tk_ai.AI_MODEL, 1.0) == "ok"
+
+
+def test_complete_ai_raises_non_retryable_at_once(mock_api, sleeps):
+    mock_api.script = [(400, {})]
+    with pytest.raises(BadRequestError):
+        tk_ai.complete_ai(mock_api.client, "p", 1.0, tk_ai.RateLimiter(0), 4, _DictCache())
+    assert mock_api.requests == 1 and not sleeps
+
+
+def test_complete_ai_gives_up_after_max_retries(mock_api, sleeps):
+    mock_api.script = [(429, {"Retry-After": "0"})] * 5
+    with pytest.raises(RateLimitError):
+        tk_ai.complete_ai(mock_api.client, "p", 1.0, tk_ai.RateLimiter(0), 2, _DictCache())
+    assert mock_api.requests == 3 and len(sleeps) == 2
+
+
+def test_run_batch_copy_close_cancels_queued_products(mock_api):
+    mock_api.delay = 0.05
+    products = [(i, f"Item {i}") for i in range(20)]
+    rows = tk_ai.run_batch_copy(mock_api.client, products, 1.0, _DictCache(), concurrency=1, rpm=0)
+    first = next(rows)
+    rows.close()
+    threading.Event().wait(0.5)
+    assert first["状态"] == "✅"
+    # 每个商品 4 次调用; 关闭时最多还有 1 个商品在跑, 其余排队的应被取消
+    assert mock_api.requests <= 8
+
+
+ONESHOT_DOC = json.dumps({"keywords": "led, lamp", "title": "Glow \"Lamp\" \\ 🔥 café", "description": "Line 1\nLine 2\t/ end",
+                          "script": "Hook 😀 ok"}, ensure_ascii=True)
+
+
+def _feed_in_pieces(text, cuts):
+    parser, seen = tk_ai.JsonFieldStream(), []
+    for lo, hi in zip([0] + cuts, cuts + [len(text)]):
+        seen.append(parser.feed(text[lo:hi]))
+    return parser, seen
+
+
+def test_json_field_stream_any_two_chunk_split():
+    # ensure_ascii 让 emoji 变成 \ud83d\udd25 代理对, 逐个切点切开, 转义和代理对的每个位置都会被切到
+    expected = json.loads(ONESHOT_DOC)
+    for cut in range(1, len(ONESHOT_DOC)):
+        parser, _ = _feed_in_pieces(ONESHOT_DOC, [cut])
+        assert parser.values == expected and parser.done == set(expected), cut
+
+
+def test_json_field_stream_char_by_char_reports_growing_prefixes():
+    expected = json.loads(ONESHOT_DOC)
+    parser, seen = _feed_in_pieces(ONESHOT_DOC, list(range(1, len(ONESHOT_DOC))))
+    assert parser.values == expected
+    for update in seen:
+        for field, value in update.items(): assert expected[field].startswith(value)
+
+
+def test_json_field_stream_skips_arrays_and_nested_objects_until_finish():
+    doc = '{"keywords": ["led", "lamp"], "meta": {"title": "inner", "n": [1, {"k": "]}"}]}, "title": "Lamp", "price": 9.5}'
+    parser = tk_ai.JsonFieldStream()
+    parser.feed(doc)
+    assert parser.values == {"title": "Lamp"}  # 嵌套里的同名字段不会覆盖顶层
+    fields = parser.finish(doc)
+    assert fields["keywords"] == "led, lamp" and fields["title"] == "Lamp" and fields["price"] == "9.5"
+
+
+def test_json_field_stream_finish_parses_fenced_output_and_keeps_streamed_values_on_bad_json():
+    fenced = "```json\n" + ONESHOT_DOC + "\n```"
+    parser = tk_ai.JsonFieldStream()
+    parser.feed(fenced)
+    assert parser.finish(fenced) == json.loads(ONESHOT_DOC)
+    truncated = '{"keywords": "a, b", "title": "Half'
+    parser = tk_ai.JsonFieldStream()
+    parser.feed(truncated)
+    assert parser.finish(truncated) == {"keywords": "a, b", "title": "Half"}
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tk_core
+
+
+def test_clean_currency_series_matches_row_wise():
+    values = ['$12.99', '1.2k', '3.5万', '2w', '1,234', '  8,888.5 ', 'N/A', '€0.99', '12K', '售价 45元', None, np.nan, '']
+    col = pd.Series(values, dtype=object)
+    assert np.array_equal(tk_core.clean_currency_series(col), col.apply(tk_core.clean_currency).to_numpy(dtype='float64'))
+
+
+def test_clean_currency_series_numeric_column_matches_row_wise():
+    col = pd.Series([12.5, -3.0, 0.0, 1e-5, 2.5e17, np.nan, 7])
+    assert np.array_equal(tk_core.clean_currency_series(col), col.apply(tk_core.clean_currency).to_numpy(dtype='float64'))
+
+
+def test_clean_currency_series_mixed_types_match_row_wise():
+    col = pd.Series([True, 1, 1.0, False, 0, '1k', np.True_, 10**20, 1e20, None], dtype=object)
+    out = tk_core.clean_currency_series(col)
+    assert out[:3].tolist() == [0.0, 1.0, 1.0]
+    assert np.array_equal(out, col.apply(tk_core.clean_currency).to_numpy(dtype='float64'))
+
+
+def test_currency_benchmark_reports_parity():
+    assert tk_core.benchmark_currency_parsing(20_000)["结果一致"].all()
+
+
+def test_score_tiers_matches_calculate_score():
+    max_gmv = 1000.0
+    gmv = np.array([0, 1, 49.99, 50, 199.99, 200, 499.99, 500, 1000, np.nan])
+    _, tiers = tk_core.score_tiers(gmv, max_gmv)
+    assert tiers.tolist() == [tk_core.calculate_score({'GMV': g}, max_gmv)[0] for g in gmv]
+
+
+def test_score_tiers_per_row_max_and_zero_max():
+    score, tiers = tk_core.score_tiers([10.0, 10.0, 5.0], np.array([10.0, 0.0, 100.0]))
+    assert score.tolist() == [100.0, 0.0, 5.0]
+    assert tiers.tolist() == ["S", "C", "B"]
+
+
+def _write_csv(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize("ext", [".csv", ".xlsx"])
+def test_loader_reads_path_and_file_object_alike(tmp_path, ext):
+    if ext == ".xlsx": pytest.importorskip("openpyxl")
+    df = pd.DataFrame({"Product Name": [f"Item {i}" for i in range(25)], "Price": ["$1.50"] * 25, "Sales": ["1.2k"] * 25})
+    path = str(tmp_path / f"t{ext}")
+    df.to_csv(path, index=False) if ext == ".csv" else df.to_excel(path, index=False)
+    cols = list(tk_core.sniff_uploaded_table(path, path).columns)
+    chunks = list(tk_core.iter_uploaded_chunks(path, path, cols, ["Product Name", "Sales"], chunk_rows=10))
+    assert [len(c) for c, _ in chunks] == [10, 10, 5] and chunks[-1][1] == 1.0
+    with open(path, "rb") as f:
+        f.read(7)  # 上传对象可能已被读过, 加载器应从头读
+        from_file = tk_core.stream_clean_frame(f, path, cols, "Product Name", "Price", "Sales", "无")
+    pd.testing.assert_frame_equal(from_file, tk_core.stream_clean_frame(path, path, cols, "Product Name", "Price", "Sales", "无"))
+    assert from_file["GMV"].iat[0] == pytest.approx(1800.0)
+
+
+def test_ingest_rejects_unknown_override(tmp_path):
+    path = _write_csv(tmp_path / "d1.csv", "Product Name,Price,Sales\nA,$1.00,10\n")
+    with pytest.raises(ValueError):
+        tk_core.ingest_export_file(path, {"price": "售价typo"})
+
+
+def test_ingest_rejects_collapsed_columns(tmp_path):
+    path = _write_csv(tmp_path / "one.csv", "x\n1\n2\n")
+    frames, errors = tk_core.ingest_exports([path], workers=1)
+    assert not frames and "ValueError" in errors[0][1]
+
+
+def test_score_report_ranks_and_prices_profit_exactly(tmp_path):
+    path = _write_csv(tmp_path / "d1.csv", "商品名称,价格,销量\nA,$12.99,12k\nB,$5.10,300\n")
+    frames, errors = tk_core.ingest_exports([path], workers=1)
+    rules = tk_core.profit_rules_from_inputs(20, 5.0, pd.DataFrame(tk_core.DEFAULT_SHIP_TIERS))
+    report = tk_core.score_report(frames, rules)
+    assert not errors
+    assert report['Title'].tolist() == ["A", "B"] and report['Rank'].tolist() == [1, 2]
+    assert report['Tier'].tolist() == ["S", "C"]
+    assert report['Profit_GMV'].iat[0] == pytest.approx(80910.0, abs=1e-6)
+
+
+def test_find_export_files_skips_output(tmp_path):
+    a = _write_csv(tmp_path / "a.csv", "x\n1\n")
+    out = _write_csv(tmp_path / "report.csv", "x\n1\n")
+    assert tk_core.find_export_files([str(tmp_path)], exclude=[out]) == [a]
+
+
+def test_score_rejects_unknown_output_format_before_ingest(tmp_path, monkeypatch):
+    path = _write_csv(tmp_path / "d1.csv", "商品名称,价格,销量\nA,$12.99,12k\n")
+    monkeypatch.setattr(tk_core, "ingest_exports", lambda *a, **k: pytest.fail("ingest ran before -o was validated"))
+    with pytest.raises(SystemExit) as exc:
+        tk_core.main(["score", path, "-o", str(tmp_path / "out.xlsx")])
+    assert exc.value.code == 2
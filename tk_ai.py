@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+# ==========================================
+# TK 文案生成: 模型配置 / 提示词 / 批量并发 (限速 + 429/5xx 退避重试), 不依赖 Streamlit
+# 一键生成的流式 JSON 字段解析也在这里; 看板 (tk_dashboard.py) 调用, 响应缓存由调用方传入 (需提供 get/put)
+# ==========================================
+
+AI_MODEL = "deepseek-chat"
+AI_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")  # 可指向本地 OpenAI 兼容的 mock 服务做联调
+
+# --- 文案提示词: 单品按钮与批量生成共用 ---
+def build_keyword_prompt(orig_name):
+    return f"As a TikTok SEO expert, extract 5-8 high-traffic, relevant English keywords from this product title: '{orig_name}'. Output ONLY the keywords separated by commas, no other text."
+
+def build_title_prompt(orig_name, keywords):
+    return f"""
+    Act as a TikTok Shop copywriter. Create ONE optimized product title based on: "{orig_name}".
+    Target Keywords: {keywords}.
+    Rules:
+    1. Length: Keep it between 40-80 characters (Mobile optimized).
+    2. Structure: [Adjective/Hook] + [Core Product Name] + [Benefit/Feature] + [Emoji].
+    3. Goal: High Click-Through Rate (CTR) and SEO friendly.
+    4. Output ONLY the title, no explanations.
+    """
+
+def build_desc_prompt(title, keywords):
+    return f"""
+    Write a high-converting TikTok Shop product description for: "{title}".
+    Keywords: {keywords}.
+    Structure (Strictly follow this):
+    1. **Hook**: A short, punchy sentence to grab attention.
+    2. **Pain Point & Solution**: Relate to a user problem and how this solves it.
+    3. **Key Features**: 3-4 bullet points highlighting benefits (not just specs).
+    4. **CTA**: Clear Call to Action (e.g., "Grab yours now!").
+    Tone: Authentic, Exciting, Viral. English only. 
+    Length: Concise, about 150-250 words. Do not write fluff.
+    """
+
+def build_script_prompt(target, keywords):
+    return f"Write a TikTok video script for: {target}. Keywords: {keywords}. Style: User Generated Content (UGC) feel. Include: Visual Hook (0-3s), Problem Agitation, Product Demo, Social Proof, CTA."
+
+def build_oneshot_prompt(orig_name):
+    return f"""
+    Act as a TikTok Shop SEO expert and copywriter for this product: "{orig_name}".
+    Return ONE JSON object with exactly these string fields, in this order:
+    "keywords": 5-8 high-traffic, relevant English keywords separated by commas.
+    "title": ONE optimized product title, 40-80 characters, structure [Adjective/Hook] + [Core Product Name] + [Benefit/Feature] + [Emoji], using the keywords.
+    "description": a high-converting product description in Markdown: **Hook**, **Pain Point & Solution**, 3-4 benefit bullet points, **CTA**. Authentic, exciting, viral tone, English only, about 150-250 words, no fluff.
+    "script": a TikTok video script in UGC style for the title above, with Visual Hook (0-3s), Problem Agitation, Product Demo, Social Proof, CTA.
+    Output ONLY the JSON object.
+    """
+
+# --- 一键生成: 模型按 JSON 对象流式返回各字段, 边收边解析 ---
+class JsonFieldStream:
+    # 增量解析扁平 JSON 对象里的字符串字段: 每喂入一段文本, 返回本次有更新的 {字段: 当前已收到的值}
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self.values = {}
+        self.done = set()
+        self._state = "seek_key"
+        self._key = ""
+        self._buf = []
+        self._escape = None  # None / "" (刚读到反斜杠) / "uXXXX" 累积中
+        self._high_surrogate = None
+
+    def feed(self, text):
+        updated = set()
+        for ch in text:
+            state = self._state
+            if state == "seek_key":
+                if ch == '"': self._state, self._key = "in_key", ""
+            elif state == "in_key":
+                if ch == '"': self._state = "seek_colon"
+                else: self._key += ch
+            elif state == "seek_colon":
+                if ch == ':': self._state = "seek_value"
+            elif state == "seek_value":
+                if ch == '"': self._state, self._buf = "in_value", []
+                elif not ch.isspace():
+                    # 非字符串值 (数组/数字等) 只跳过, 交给 finish() 兜底
+                    self._state, self._depth, self._skip_str, self._skip_esc = "skip_value", int(ch in '[{'), False, False
+            elif state == "skip_value":
+                if self._skip_str:
+                    if self._skip_esc: self._skip_esc = False
+                    elif ch == '\\': self._skip_esc = True
+                    elif ch == '"': self._skip_str = False
+                elif ch == '"': self._skip_str = True
+                elif ch in '[{': self._depth += 1
+                elif ch in ']}':
+                    self._depth -= 1
+                    if self._depth < 0: self._state = "seek_key"
+                elif ch == ',' and self._depth == 0: self._state = "seek_key"
+            elif state == "in_value":
+                if self._escape is not None: self._read_escape(ch)
+                elif ch == '\\': self._escape = ""
+                elif ch == '"':
+                    self.values[self._key] = "".join(self._buf)
+                    self.done.add(self._key)
+                    self._state = "seek_key"
+                else: self._buf.append(ch)
+                if self._state == "in_value": self.values[self._key] = "".join(self._buf)
+                updated.add(self._key)
+        return {k: self.values[k] for k in updated if k in self.values}
+
+    def _read_escape(self, ch):
+        if self._escape == "" and ch != 'u':
+            self._buf.append(self._ESCAPES.get(ch, ch)); self._escape = None
+            return
+        self._escape += ch
+        if len(self._escape) < 5: return
+        code, self._escape = int(self._escape[1:], 16), None
+        if 0xD800 <= code < 0xDC00: self._high_surrogate = code; return
+        if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        self._buf.append(chr(code))
+
+    def finish(self, full_text):
+        # 流结束后整体解析一次, 补齐数组等非字符串字段 (如 keywords 以列表形式返回)
+        try: obj = json.loads(full_text[full_text.find('{'):full_text.rfind('}') + 1])
+        except ValueError: return self.values
+        for k, v in obj.items():
+            self.values[k] = ", ".join(map(str, v)) if isinstance(v, list) else str(v)
+        return self.values
+
+# --- 批量文案: 线程池并发跑 关键词→标题→描述→脚本, 带限速与 429/5xx 退避重试 ---
+class RateLimiter:
+    # 多线程共享的请求发车间隔, 保证整体不超过每分钟 rpm 次
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.interval
+        if start_at > now: time.sleep(start_at - now)
+
+def _is_retryable(exc):
+    if isinstance(exc, (RateLimitError, APIConnectionError)): return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+def _retry_delay(exc, attempt):
+    # 优先服从服务端 Retry-After, 否则指数退避 + 抖动
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try: return min(float(headers.get('retry-after')), 60.0)
+    except (TypeError, ValueError): return min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+
+def complete_ai(client, prompt, temp, limiter, max_retries, llm_cache, refresh=False):
+    cached = None if refresh else llm_cache.get(prompt, AI_MODEL, temp)
+    if cached is not None: return cached
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        try:
+            resp = client.chat.completions.create(model=AI_MODEL, messages=[{"role": "user", "content": prompt}], temperature=temp)
+            text = (resp.choices[0].message.content or "").strip()
+            if text: llm_cache.put(prompt, AI_MODEL, temp, text)
+            return text
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e): raise
+            time.sleep(_retry_delay(e, attempt))
+
+def generate_listing_copy(client, orig_name, temp, limiter, max_retries, llm_cache, refresh=False):
+    keywords = complete_ai(client, build_keyword_prompt(orig_name), 1.0, limiter, max_retries, llm_cache, refresh)
+    title = complete_ai(client, build_title_prompt(orig_name, keywords), temp, limiter, max_retries, llm_cache, refresh)
+    desc = complete_ai(client, build_desc_prompt(title, keywords), temp, limiter, max_retries, llm_cache, refresh)
+    script = complete_ai(client, build_script_prompt(title or orig_name, keywords), temp, limiter, max_retries, llm_cache, refresh)
+    return {"关键词": keywords, "SEO 标题": title, "商品描述": desc, "视频脚本": script}
+
+def run_batch_copy(client, products, temp, llm_cache, concurrency=4, rpm=60, max_retries=4, refresh=False):
+    # products: [(product_id, 原标题)]; 按完成顺序逐个产出结果行, 单个商品失败不影响其它
+    # llm_cache 需线程安全 (get/put), 由调用方在脚本线程取出再交给工作线程
+    limiter = RateLimiter(rpm)
+    batch_client = client.with_options(max_retries=0, timeout=120)  # 重试由 complete_ai 统一控制
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = {pool.submit(generate_listing_copy, batch_client, name, temp, limiter, max_retries, llm_cache, refresh): (pid, name) for pid, name in products}
+        for fut in as_completed(futures):
+            pid, name = futures[fut]
+            row = {"Product_Id": pid, "原标题": name}
+            try: row.update(fut.result()); row["状态"] = "✅"
+            except Exception as e: row["状态"] = f"❌ {e}"
+            yield row
+    finally:
+        # 有控件交互时 Streamlit 会丢弃这个生成器; 不等待, 直接取消还在排队的商品, 避免阻塞脚本线程还白付调用费
+        pool.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,387 @@
+import re
+import os
+import io
+import sys
+import glob
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# TK 选品核心管线: 解析 / 清洗 / GMV / 评级 / 利润, 不依赖 Streamlit
+# 看板 (tk_dashboard.py) 与命令行批处理共用; 命令行用法: python tk_core.py --help
+# ==========================================
+
+# --- 逐行解析 (参考实现) ---
+def clean_currency(val):
+    if pd.isna(val): return 0
+    s = str(val).strip().lower().replace(',', '')
+    multiplier = 1
+    if 'k' in s: multiplier = 1000; s = s.replace('k', '')
+    if 'w' in s or '万' in s: multiplier = 10000; s = s.replace('w', '').replace('万', '')
+    match = re.search(r'(\d+(\.\d+)?)', s)
+    if match: return float(match.group(1)) * multiplier
+    return 0
+
+# --- 列式解析: 与 clean_currency 逐行结果一致, 整列一次完成 ---
+CURRENCY_NUM_PAT = r'(\d+(?:\.\d+)?)'
+
+def clean_currency_series(ser):
+    ser = pd.Series(ser).reset_index(drop=True)
+    out = np.zeros(len(ser), dtype='float64')
+    vals = ser[ser.notna()]
+    if pd.api.types.is_numeric_dtype(vals) and not pd.api.types.is_bool_dtype(vals):
+        # 纯数字列: 负号会被正则忽略, 只有科学计数法的 str() 结果需要走字符串路径
+        nums = vals.astype('float64').abs()
+        sci = ~np.isfinite(nums) | (nums >= 1e16) | ((nums > 0) & (nums < 1e-4))
+        out[nums.index] = nums.to_numpy()
+        vals = vals[sci]
+    if len(vals):
+        # 导出表里的价格/销量文本大量重复, 先去重再解析, 最后按编码回填
+        codes, uniques = pd.factorize(vals)
+        if pd.api.types.infer_dtype(vals, skipna=True) not in ('string', 'empty'):
+            # 混合类型列: True/1/1.0 值相等会被并进同一桶, 但 str() 结果不同; 把类型也并进键, 每桶取首次出现的原值
+            kinds = pd.factorize(vals.map(type).to_numpy())[0]
+            codes = pd.factorize(codes.astype('int64') * (kinds.max() + 1) + kinds)[0]
+            first = np.flatnonzero(codes > np.r_[-1, np.maximum.accumulate(codes)[:-1]])
+            uniques = vals.to_numpy()[first]
+        s = pd.Series(uniques, dtype=object).astype(str).str.strip().str.lower().str.replace(',', '', regex=False)
+        multiplier = np.where(s.str.contains('w|万', regex=True), 10000.0,
+                              np.where(s.str.contains('k', regex=False), 1000.0, 1.0))
+        nums = s.str.replace('[kw万]', '', regex=True).str.extract(CURRENCY_NUM_PAT, expand=False).astype('float64')
+        out[vals.index] = (nums * multiplier).fillna(0.0).to_numpy()[codes]
+    return out
+
+def benchmark_currency_parsing(n_rows=1_000_000, seed=0):
+    rng = np.random.default_rng(seed)
+    samples = np.array(['$12.99', '1.2k', '3.5万', '2w', '1,234', '  8,888.5 ', 'N/A', '€0.99', '12K', '售价 45元'], dtype=object)
+    text_col = pd.Series(samples[rng.integers(0, len(samples), n_rows)])
+    text_col[rng.random(n_rows) < 0.05] = np.nan
+    num_col = pd.Series(rng.gamma(2.0, 30.0, n_rows).round(2))
+    num_col[rng.random(n_rows) < 0.05] = np.nan
+    wide_col = pd.Series(rng.integers(0, 10**6, n_rows).astype(str).astype(object) + np.where(rng.random(n_rows) < 0.5, '', 'k'))
+    rows = []
+    for label, col in [("文本列", text_col), ("数值列", num_col), ("高基数文本列", wide_col)]:
+        t0 = time.perf_counter(); ref = col.apply(clean_currency).to_numpy(dtype='float64'); t_apply = time.perf_counter() - t0
+        t0 = time.perf_counter(); vec = clean_currency_series(col); t_vec = time.perf_counter() - t0
+        rows.append({"数据": label, "行数": n_rows, "apply 耗时(s)": round(t_apply, 3), "向量化耗时(s)": round(t_vec, 3),
+                     "加速比": round(t_apply / t_vec, 1) if t_vec > 0 else None, "结果一致": bool(np.array_equal(ref, vec))})
+    return pd.DataFrame(rows)
+
+# --- 两阶段加载: 先只读表头+样本做字段猜测, 再按块流式读取选中列 ---
+# source 为文件路径或二进制文件对象 (如 Streamlit 上传对象), bytes 也接受; 传路径时整份文件不进内存, 峰值约为一个块,
+# 传内存里的文件对象则另加文件本身 (不再额外复制). xlsx 经 openpyxl 只读模式按行流式解析
+INGEST_SNIFF_ROWS = 1000
+INGEST_CHUNK_ROWS = 200_000
+
+def _open_source(source):
+    # 返回 (二进制文件对象, 是否由这里打开需要关闭); 传进来的文件对象可能被读过, 先回到开头
+    if isinstance(source, (bytes, bytearray)): return io.BytesIO(source), True
+    if isinstance(source, (str, os.PathLike)): return open(source, 'rb'), True
+    source.seek(0)
+    return source, False
+
+def _excel_header(values):
+    names, seen = [], {}
+    for i, v in enumerate(values):
+        name = f"Unnamed: {i}" if v is None else str(v)
+        if name in seen: seen[name] += 1; name = f"{name}.{seen[name]}"
+        else: seen[name] = 0
+        names.append(name)
+    return names
+
+def _iter_excel_rows(source):
+    from openpyxl import load_workbook
+    f, owned = _open_source(source)
+    wb = load_workbook(f, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        yield ws.max_row
+        yield from ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+        if owned: f.close()
+
+def sniff_uploaded_table(source, file_name, n_rows=INGEST_SNIFF_ROWS):
+    if file_name.endswith('.csv'):
+        f, owned = _open_source(source)
+        try: return pd.read_csv(f, nrows=n_rows)
+        finally:
+            if owned: f.close()
+    rows = _iter_excel_rows(source)
+    next(rows)
+    header = _excel_header(next(rows))
+    sample = [r for _, r in zip(range(n_rows), rows)]
+    rows.close()
+    return pd.DataFrame(sample, columns=header)
+
+def iter_uploaded_chunks(source, file_name, cols, usecols, chunk_rows=INGEST_CHUNK_ROWS):
+    # 产出 (只含 usecols 的数据块, 进度 0~1); 列位置按 cols 的顺序定位, 避免重名列歧义
+    idx = sorted({cols.index(c) for c in usecols})
+    if file_name.endswith('.csv'):
+        f, owned = _open_source(source)
+        try:
+            size = f.seek(0, os.SEEK_END); f.seek(0)
+            with pd.read_csv(f, usecols=idx, chunksize=chunk_rows) as reader:
+                for chunk in reader:
+                    chunk.columns = [cols[i] for i in idx]
+                    yield chunk, min(f.tell() / max(size, 1), 1.0)
+        finally:
+            if owned: f.close()
+        return
+    rows = _iter_excel_rows(source)
+    total = next(rows) or 0
+    next(rows)
+    batch, done = [], 1
+    for r in rows:
+        batch.append([r[i] if i < len(r) else None for i in idx])
+        if len(batch) >= chunk_rows:
+            done += len(batch)
+            yield pd.DataFrame(batch, columns=[cols[i] for i in idx]), min(done / total, 1.0) if total else 0.0
+            batch = []
+    if batch: yield pd.DataFrame(batch, columns=[cols[i] for i in idx]), 1.0
+
+def build_clean_frame(df, col_name, col_price, col_sales, col_img):
+    # 紧凑列式结果: 标题/图片为 Arrow 字符串, 销量为 float32; 价格与 GMV 保留 float64, 利润/利润 GMV 才能与 GMV 对得上
+    df = df.reset_index(drop=True)
+    price = clean_currency_series(df[col_price])
+    sales = clean_currency_series(df[col_sales])
+    main_df = pd.DataFrame({col_name: df[col_name].astype(str).where(df[col_name].notna()).astype('string[pyarrow]')})
+    main_df['Clean_Price'] = price
+    main_df['Clean_Sales'] = sales.astype('float32')
+    main_df['GMV'] = price * sales
+    if col_img != "无": main_df['Image_Url'] = df[col_img].astype(str).astype('string[pyarrow]')
+    main_df['Product_Key'] = product_key_series(main_df[col_name])
+    return main_df
+
+def stream_clean_frame(source, file_name, cols, col_name, col_price, col_sales, col_img, on_progress=None):
+    usecols = [col_name, col_price, col_sales] + ([col_img] if col_img != "无" else [])
+    parts = []
+    for chunk, frac in iter_uploaded_chunks(source, file_name, cols, usecols):
+        parts.append(build_clean_frame(chunk, col_name, col_price, col_sales, col_img))
+        if on_progress: on_progress(frac, sum(len(p) for p in parts))
+    if not parts: parts = [build_clean_frame(pd.DataFrame(columns=list(dict.fromkeys(usecols))), col_name, col_price, col_sales, col_img)]
+    main_df = pd.concat(parts, ignore_index=True)
+    main_df['Product_Id'] = product_id_series(main_df['Product_Key'])
+    return main_df
+
+def guess_columns(cols):
+    # 按常见导出表头猜 (标题, 价格, 销量, 图片) 列; 图片列猜不到时为 "无"
+    guess_name = next((c for c in cols if 'Title' in c or '名称' in c or 'Name' in c), cols[0])
+    guess_price = next((c for c in cols if 'Price' in c or '价格' in c), cols[1] if len(cols)>1 else cols[0])
+    guess_sales = next((c for c in cols if 'Sales' in c or '销量' in c), cols[2] if len(cols)>2 else cols[0])
+    guess_img = next((c for c in cols if 'Image' in c or 'Img' in c or 'Pic' in c or '图' in c or 'Cover' in c), "无")
+    return guess_name, guess_price, guess_sales, guess_img
+
+# --- 商品键: 标题归一化哈希 + 出现序号, 跨文件/跨天稳定 ---
+SNAPSHOT_TITLE_PAT = r'[^\p{L}\p{N}]+'  # RE2 语法, 中文等非 ASCII 字符按字母保留
+
+def product_key_series(titles):
+    # 标题归一化 (小写, 非字母数字折叠为空格) 后取 64 位哈希; Arrow 正则整列处理, 只对去重后的标题求哈希
+    norm = titles.astype('string[pyarrow]').fillna("").str.lower().str.replace(SNAPSHOT_TITLE_PAT, " ", regex=True).str.strip()
+    codes, uniques = pd.factorize(norm)
+    keys = np.fromiter((int.from_bytes(hashlib.blake2b(u.encode("utf-8"), digest_size=8).digest(), "little", signed=True) for u in uniques),
+                       dtype=np.int64, count=len(uniques))
+    return pd.Series(keys[codes], index=titles.index)
+
+PRODUCT_ID_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+def product_id_series(product_keys):
+    # 稳定商品 ID: 标题键 + 同标题内的出现序号; 重名商品各有各的 ID, 同一份表重新上传 ID 不变
+    occurrence = product_keys.groupby(product_keys, sort=False).cumcount().to_numpy(dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        ids = product_keys.to_numpy(dtype=np.int64).view(np.uint64) + occurrence * PRODUCT_ID_MIX
+    return pd.Series(ids.view(np.int64), index=product_keys.index)
+
+# --- 利润模型: 进货成本按售价比例 + 按价格档位的头程运费 + 平台佣金, 整列一次算完 ---
+DEFAULT_COST_PCT = 20
+DEFAULT_PLATFORM_FEE_PCT = 5.0
+DEFAULT_SHIP_TIERS = [(10.0, 2.0), (30.0, 3.0), (60.0, 4.5), (999_999.0, 6.0)]  # (售价上限, 运费)
+
+def profit_rules_from_inputs(cost_pct, fee_pct, tiers_df):
+    # 规则转成可哈希的元组, 作为缓存键和 view_key 的一部分; 表格里没填完整的档位直接忽略
+    tiers = tiers_df.apply(pd.to_numeric, errors='coerce').dropna()
+    tiers = tiers.sort_values(tiers.columns[0], kind='stable')
+    return (cost_pct / 100, fee_pct / 100, tuple(map(tuple, tiers.to_numpy(dtype='float64').tolist())))
+
+def shipping_cost(price, tiers):
+    # 售价 ≤ 档位上限取该档运费, 超出最后一档按最后一档; 没配置档位时运费为 0
+    price = np.asarray(price, dtype='float64')
+    if not tiers: return np.zeros_like(price)
+    bounds, fees = np.array(tiers, dtype='float64').T
+    return fees[np.minimum(np.searchsorted(bounds, price, side='left'), len(fees) - 1)]
+
+def profit_columns(price, sales, rules):
+    cost_pct, fee_pct, tiers = rules
+    price = np.asarray(price, dtype='float64')
+    profit = price * (1 - cost_pct - fee_pct) - shipping_cost(price, tiers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = np.where(price > 0, profit / price * 100, 0.0)
+    # 利润 GMV = 单件利润 × 销量, 与 GMV 一样保留 float64
+    return {"Profit": profit.astype('float32'), "Margin": margin.astype('float32'), "Profit_GMV": profit * np.asarray(sales, dtype='float64')}
+
+# --- 评级: S/A/B/C 按 GMV 占池内最高 GMV 的百分比划档 ---
+def calculate_score(row, max_gmv):
+    score_val = (row['GMV'] / max_gmv) * 100
+    if score_val >= 50: return "S", "🔥 顶级爆款 (S级)", "score-s"
+    elif score_val >= 20: return "A", "🚀 潜力热销 (A级)", "score-a"
+    elif score_val >= 5: return "B", "⚖️ 稳健出单 (B级)", "score-a"
+    else: return "C", "🌱 起步阶段 (C级)", "score-a"
+
+SCORE_TIER_CUTS = np.array([5.0, 20.0, 50.0])  # 与 calculate_score 的档位一致, 分数 ≥ 档位下限即升档
+SCORE_TIER_LABELS = np.array(["C", "B", "A", "S"])
+
+def score_tiers(gmv, max_gmv):
+    # calculate_score 的整列版本: 返回 (分数 0~100, 档位); max_gmv 可以是标量或逐行数组 (按文件评级), 非正时记 0 分
+    gmv, max_gmv = np.asarray(gmv, dtype='float64'), np.asarray(max_gmv, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(max_gmv > 0, gmv / max_gmv * 100, 0.0)
+    score = np.nan_to_num(score, nan=0.0)
+    return score, SCORE_TIER_LABELS[np.searchsorted(SCORE_TIER_CUTS, score, side='right')]
+
+
+# --- 批处理: 进程池并行摄取一整个目录的导出表, 合并后整列评级, 输出一份按 GMV 排名的报表 ---
+EXPORT_PATTERNS = ("*.csv", "*.xlsx")
+REPORT_TIER_ORDER = ["S", "A", "B", "C"]
+
+def find_export_files(paths, exclude=()):
+    # exclude: 不当作输入的路径 (如本次输出的报表, 否则写进输入目录后下次运行会被当成导出表)
+    skip = {os.path.abspath(p) for p in exclude}
+    files = []
+    for p in paths:
+        if os.path.isdir(p): files += sorted(f for pat in EXPORT_PATTERNS for f in glob.glob(os.path.join(p, pat)))
+        else: files.append(p)
+    return [f for f in dict.fromkeys(files) if os.path.abspath(f) not in skip]
+
+def ingest_export_file(path, col_overrides=None):
+    # 单文件: 猜列 (命令行指定的列优先) → 分块清洗; 标题列统一改名为 Title, 多份表才能合并
+    # 无人值守, 没有人核对字段映射: 指定的列不存在、或标题/价格/销量落到同一列时直接报错, 由调用方记入失败清单
+    # 直接传路径给加载器, 按块读盘, 不把整份文件读进内存
+    file_name = os.path.basename(path).lower()
+    cols = list(sniff_uploaded_table(path, file_name).columns)
+    picked = list(guess_columns(cols))
+    for i, key in enumerate(("name", "price", "sales", "img")):
+        col = (col_overrides or {}).get(key)
+        if col is None: continue
+        if col not in cols and not (key == "img" and col == "无"): raise ValueError(f"--{key}-col {col!r} 不在表头中: {cols}")
+        picked[i] = col
+    col_name, col_price, col_sales, col_img = picked
+    if len({col_name, col_price, col_sales}) < 3:
+        raise ValueError(f"标题/价格/销量列无法区分 ({col_name!r}, {col_price!r}, {col_sales!r}), 请用 --name-col/--price-col/--sales-col 指定")
+    df = stream_clean_frame(path, file_name, cols, col_name, col_price, col_sales, col_img).rename(columns={col_name: 'Title'})
+    if 'Image_Url' not in df: df['Image_Url'] = pd.Series(pd.NA, index=df.index, dtype='string[pyarrow]')
+    df.insert(0, 'Source_File', os.path.basename(path))
+    return df
+
+def _ingest_worker(path, col_overrides):
+    # 进程池里单个文件失败不拖垮整批, 错误带回主进程汇总
+    try: return ingest_export_file(path, col_overrides), None
+    except Exception as e: return None, f"{type(e).__name__}: {e}"
+
+def ingest_exports(files, workers=None, col_overrides=None):
+    # workers=1 时在本进程串行, 便于调试, 也是基准的对照组
+    if workers == 1: results = [_ingest_worker(f, col_overrides) for f in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_ingest_worker, files, [col_overrides] * len(files)))
+    frames = [df for df, _ in results if df is not None]
+    errors = [(f, err) for f, (_, err) in zip(files, results) if err]
+    return frames, errors
+
+def score_report(frames, rules, per_file=False, min_sales=0):
+    report = pd.concat(frames, ignore_index=True)
+    report = report[report['Clean_Sales'] >= min_sales]
+    max_gmv = report.groupby('Source_File', sort=False)['GMV'].transform('max') if per_file else report['GMV'].max()
+    score, tier = score_tiers(report['GMV'], max_gmv)
+    report = report.assign(Score=score.astype('float32'), Tier=pd.Categorical(tier, categories=REPORT_TIER_ORDER),
+                           **profit_columns(report['Clean_Price'], report['Clean_Sales'], rules))
+    report = report.iloc[np.argsort(-report['GMV'].to_numpy(), kind='stable')].reset_index(drop=True)
+    report.insert(0, 'Rank', np.arange(1, len(report) + 1))
+    return report
+
+REPORT_FORMATS = ('.parquet', '.csv')
+
+def write_report(report, out_path):
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext == '.parquet': report.to_parquet(out_path, index=False)
+    elif ext == '.csv': report.to_csv(out_path, index=False, encoding='utf-8-sig')  # 带 BOM, Excel 直接打开中文不乱码
+    else: raise ValueError(f"不支持的报表格式: {ext} (仅 .parquet / .csv)")
+
+def write_synthetic_exports(out_dir, n_files, n_rows, seed=0):
+    # 仿 Kalodata 导出: 文本价格/销量 ($12.99, 1.2k), 标题有大量重复
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n_files):
+        price = rng.gamma(2.0, 10.0, n_rows).round(2)
+        sales = rng.integers(0, 50_000, n_rows)
+        df = pd.DataFrame({
+            "Product Name": [f"Item {k} cool gadget" for k in rng.integers(0, n_rows // 4 + 1, n_rows)],
+            "Price": ["$" + f"{p:.2f}" for p in price],
+            "Sales": [f"{s / 1000:.1f}k" if s >= 1000 else str(s) for s in sales],
+            "Cover Image": [f"http://x/{i}_{k}.jpg" for k in range(n_rows)],
+        })
+        paths.append(os.path.join(out_dir, f"export_{i:03d}.csv"))
+        df.to_csv(paths[-1], index=False)
+    return paths
+
+def benchmark_ingest(files, worker_counts=(1, 2, 4, 8)):
+    rows, base = [], None
+    for workers in worker_counts:
+        t0 = time.perf_counter(); frames, errors = ingest_exports(files, workers); elapsed = time.perf_counter() - t0
+        n_rows = sum(len(f) for f in frames)
+        base = base or elapsed
+        rows.append({"进程数": workers, "文件数": len(files) - len(errors), "行数": n_rows, "耗时(s)": round(elapsed, 2),
+                     "文件/秒": round(len(frames) / elapsed, 2), "行/秒": int(n_rows / elapsed), "加速比": round(base / elapsed, 2)})
+    return pd.DataFrame(rows)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tk_core", description="TK 选品批处理: 多份导出表并行清洗、评级, 输出合并排名报表")
+    sub = parser.add_subparsers(dest="command", required=True)
+    score = sub.add_parser("score", help="清洗 + S/A/B/C 评级, 输出合并报表")
+    score.add_argument("inputs", nargs="+", help="导出表文件或目录 (目录下的 *.csv / *.xlsx)")
+    score.add_argument("-o", "--output", default="tk_report.parquet", help="报表路径, .parquet 或 .csv")
+    score.add_argument("-j", "--workers", type=int, default=None, help="进程数, 默认 CPU 核数")
+    score.add_argument("--top", type=int, default=0, help="只输出前 N 名, 0 为全部")
+    score.add_argument("--min-sales", type=float, default=0, help="最低销量")
+    score.add_argument("--per-file", action="store_true", help="每份表各自按最高 GMV 评级 (默认合并后统一评级)")
+    score.add_argument("--cost-pct", type=float, default=DEFAULT_COST_PCT, help="进货成本占售价百分比")
+    score.add_argument("--fee-pct", type=float, default=DEFAULT_PLATFORM_FEE_PCT, help="平台佣金百分比")
+    for key, label in [("name", "标题"), ("price", "价格"), ("sales", "销量"), ("img", "图片")]:
+        score.add_argument(f"--{key}-col", dest=f"{key}_col", help=f"{label}列名, 不填则按表头猜")
+    bench = sub.add_parser("bench", help="摄取吞吐基准: 不同进程数下的 文件/秒 与 行/秒")
+    bench.add_argument("inputs", nargs="*", help="导出表文件或目录; 留空则生成合成导出表")
+    bench.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    bench.add_argument("--files", type=int, default=24, help="合成表份数")
+    bench.add_argument("--rows", type=int, default=50_000, help="每份合成表行数")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            files = find_export_files(args.inputs) if args.inputs else write_synthetic_exports(tmp, args.files, args.rows)
+            print(benchmark_ingest(files, args.workers).to_string(index=False))
+        return 0
+
+    if os.path.splitext(args.output)[1].lower() not in REPORT_FORMATS:
+        parser.error(f"-o/--output 仅支持 {' / '.join(REPORT_FORMATS)}: {args.output}")  # 先校验, 别等清洗完才报错
+    files = find_export_files(args.inputs, exclude=[args.output])
+    if not files: print("未找到导出表 (*.csv / *.xlsx)", file=sys.stderr); return 1
+    t0 = time.perf_counter()
+    col_overrides = {"name": args.name_col, "price": args.price_col, "sales": args.sales_col, "img": args.img_col}
+    frames, errors = ingest_exports(files, args.workers, col_overrides)
+    for path, err in errors: print(f"跳过 {path}: {err}", file=sys.stderr)
+    if not frames: return 1
+    rules = profit_rules_from_inputs(args.cost_pct, args.fee_pct, pd.DataFrame(DEFAULT_SHIP_TIERS))
+    report = score_report(frames, rules, per_file=args.per_file, min_sales=args.min_sales)
+    if args.top: report = report.head(args.top)
+    write_report(report, args.output)
+    tiers = report['Tier'].value_counts().reindex(REPORT_TIER_ORDER, fill_value=0)
+    print(f"{len(frames)} 份表 / {len(report):,} 行 → {args.output} ({time.perf_counter() - t0:.1f}s) · "
+          + " ".join(f"{k}:{v}" for k, v in tiers.items()))
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
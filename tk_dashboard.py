@@ -1,15 +1,70 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import re
 import os
+import io
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import datetime
+import cProfile
+import pstats
+from collections import OrderedDict, deque
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from openai import OpenAI
+from tk_core import (benchmark_currency_parsing, sniff_uploaded_table, stream_clean_frame, guess_columns, SNAPSHOT_TITLE_PAT,
+                     DEFAULT_COST_PCT, DEFAULT_PLATFORM_FEE_PCT, DEFAULT_SHIP_TIERS, profit_rules_from_inputs, shipping_cost,
+                     profit_columns, calculate_score)
+from tk_ai import (AI_MODEL, AI_BASE_URL, build_keyword_prompt, build_title_prompt, build_desc_prompt, build_script_prompt,
+                   build_oneshot_prompt, JsonFieldStream, run_batch_copy)
 
 # ==========================================
 # 0. 全局配置
 # ==========================================
 st.set_page_config(page_title="TK选品 (Boss直连版)", page_icon="👑", layout="wide", initial_sidebar_state="expanded")
 
+# --- 性能埋点: 每轮 rerun 按阶段计时, 滚动保留历史; 可选对下一轮整体做 cProfile ---
+PERF_HISTORY = 200
+PROFILE_DIR = os.path.join(".cache", "profiles")
+
+@st.cache_resource
+def get_perf_history():
+    return deque(maxlen=PERF_HISTORY)
+
+class RerunTimer:
+    # lap(name): 把上一次 lap 到现在的耗时记到 name 名下; 脚本从上到下按段调用即可
+    def __init__(self):
+        self.started_at = self._last = time.perf_counter()
+        self.stages = {}
+        self.stats = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def note_frame(self, label, df):
+        self.stats[f"{label} 行数"] = len(df)
+        self.stats[f"{label} 内存(MB)"] = round(df.memory_usage(deep=True).sum() / 2**20, 1)
+
+    def finish(self):
+        self.stages["整轮合计"] = time.perf_counter() - self.started_at
+        get_perf_history().append(dict(self.stages))
+
+rerun_timer = RerunTimer()
+if st.session_state.get('active_profiler') is not None:
+    st.session_state.active_profiler.disable()  # 上一轮被 st.rerun 打断时没来得及停
+st.session_state.active_profiler = None
+if st.session_state.pop('profile_next_rerun', False):
+    st.session_state.active_profiler = cProfile.Profile()
+    st.session_state.active_profiler.enable()
+
 # --- CSS 样式 ---
 st.markdown("""
 <style>
@@ -27,11 +82,17 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 状态管理 ---
-if 'selected_product_title' not in st.session_state: st.session_state.selected_product_title = None
+if 'selected_product_id' not in st.session_state: st.session_state.selected_product_id = None
 if 'user_role' not in st.session_state: st.session_state.user_role = 'guest'
 if 'gen_keywords' not in st.session_state: st.session_state.gen_keywords = ""
 if 'gen_title' not in st.session_state: st.session_state.gen_title = ""
 if 'gen_desc' not in st.session_state: st.session_state.gen_desc = ""
+if 'gen_script' not in st.session_state: st.session_state.gen_script = ""
+if 'batch_results' not in st.session_state: st.session_state.batch_results = []
+if 'density_handled_sel' not in st.session_state: st.session_state.density_handled_sel = None
+if 'cluster_handled_sel' not in st.session_state: st.session_state.cluster_handled_sel = None
+if 'bar_handled_sel' not in st.session_state: st.session_state.bar_handled_sel = None
+if 'list_handled_sel' not in st.session_state: st.session_state.list_handled_sel = None
 
 # ==========================================
 # 🔒 团队密码锁
@@ -65,50 +126,718 @@ def check_password():
 if not check_password(): st.stop()
 
 # ==========================================
-# 1. 核心工具函数
+# 1. 核心工具函数 (解析/清洗/评级/利润模型在 tk_core.py, 与命令行批处理共用)
 # ==========================================
-def clean_currency(val):
-    if pd.isna(val): return 0
-    s = str(val).strip().lower().replace(',', '')
-    multiplier = 1
-    if 'k' in s: multiplier = 1000; s = s.replace('k', '')
-    if 'w' in s or '万' in s: multiplier = 10000; s = s.replace('w', '').replace('万', '')
-    match = re.search(r'(\d+(\.\d+)?)', s)
-    if match: return float(match.group(1)) * multiplier
-    return 0
-
-def calculate_score(row, max_gmv):
-    score_val = (row['GMV'] / max_gmv) * 100
-    if score_val >= 50: return "S", "🔥 顶级爆款 (S级)", "score-s"
-    elif score_val >= 20: return "A", "🚀 潜力热销 (A级)", "score-a"
-    elif score_val >= 5: return "B", "⚖️ 稳健出单 (B级)", "score-a"
-    else: return "C", "🌱 起步阶段 (C级)", "score-a"
-
-def stream_ai_response(client, prompt, placeholder_obj, temp=1.3):
+# --- 摄取缓存: 按文件内容哈希 + 字段映射缓存清洗结果, 内存 LRU + Parquet 落盘 ---
+INGEST_CACHE_DIR = os.path.join(".cache", "ingest")
+INGEST_CACHE_MAX_MEM_MB = 1024
+INGEST_CACHE_MAX_DISK_MB = 4096
+INGEST_SCHEMA_VERSION = 5  # 清洗逻辑变化时 +1, 旧缓存自动失效
+
+class IngestCache:
+    # 进程级共享 (所有会话), 取出的 DataFrame 视为只读, 需要加列请先 copy
+    def __init__(self, cache_dir, max_mem_bytes, max_disk_bytes):
+        self.cache_dir = cache_dir
+        self.max_mem_bytes = max_mem_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._items = OrderedDict()
+        self._mem_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key): return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def _remember(self, key, df, nbytes):
+        with self._lock:
+            if key in self._items: self._mem_bytes -= self._items.pop(key)[1]
+            self._items[key] = (df, nbytes)
+            self._mem_bytes += nbytes
+            while self._mem_bytes > self.max_mem_bytes and len(self._items) > 1:
+                _, (_, old_bytes) = self._items.popitem(last=False)
+                self._mem_bytes -= old_bytes
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key][0]
+        path = self._path(key)
+        if not os.path.exists(path): return None
+        try:
+            df = pd.read_parquet(path)
+            os.utime(path)  # 磁盘层按 mtime 做 LRU
+        except Exception: return None
+        self._remember(key, df, int(df.memory_usage(deep=True).sum()))
+        return df
+
+    def put(self, key, df):
+        self._remember(key, df, int(df.memory_usage(deep=True).sum()))
+        try:
+            spill = df.copy()
+            for c in spill.columns[spill.dtypes == object]:
+                # 混合类型列 (数字+文本) Arrow 无法直接写入, 统一转成字符串, 空值保持为空
+                spill[c] = spill[c].where(spill[c].isna(), spill[c].astype(str))
+            tmp_path = self._path(key) + ".tmp"
+            spill.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self._path(key))
+            self._prune_disk()
+        except Exception: pass  # 落盘失败只影响重启后的命中, 内存层照常可用
+        return df
+
+    def _prune_disk(self):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".parquet")]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        while files and total > self.max_disk_bytes:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+    def stats(self):
+        with self._lock: return {"entries": len(self._items), "mem_mb": self._mem_bytes / 2**20}
+
+@st.cache_resource
+def get_ingest_cache():
+    return IngestCache(INGEST_CACHE_DIR, INGEST_CACHE_MAX_MEM_MB * 2**20, INGEST_CACHE_MAX_DISK_MB * 2**20)
+
+def file_content_hash(f, block_size=1 << 20):
+    # 分块读文件对象算哈希, 不复制整份上传
+    h = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    for block in iter(lambda: f.read(block_size), b""): h.update(block)
+    return h.hexdigest()
+
+def ingest_cache_key(*parts):
+    raw = "|".join(str(p) for p in (INGEST_SCHEMA_VERSION,) + parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+# --- 快照库: 每份清洗后的表按日期追加进本地 SQLite, 跨天销量/GMV 走索引查询 ---
+SNAPSHOT_DB_PATH = os.path.join(".cache", "snapshots.sqlite3")
+SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    product_key INTEGER NOT NULL,
+    snapshot_date TEXT NOT NULL,
+    title TEXT,
+    price REAL,
+    sales REAL,
+    gmv REAL,
+    listings INTEGER,
+    ingest_key TEXT,
+    PRIMARY KEY (product_key, snapshot_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_snapshots_date_gmv ON snapshots (snapshot_date, gmv DESC);
+"""
+SNAPSHOT_INGESTS_DDL = """
+CREATE TABLE IF NOT EXISTS snapshot_ingests (
+    ingest_key TEXT NOT NULL PRIMARY KEY,
+    snapshot_date TEXT NOT NULL,
+    row_count INTEGER,
+    ingested_at TEXT,
+    mapping_key TEXT
+)"""
+SNAPSHOT_SCHEMA_VERSION = 3  # v2: 快照行记录来源导入, 导入登记只按 ingest_key 唯一; v3: ingest_key 为文件内容哈希, 字段映射另记 mapping_key
+SNAPSHOT_STATUS_TEXT = {"saved": "存入", "moved": "改存到", "replaced": "按新字段映射重写"}
+SNAPSHOT_DATE_RE = re.compile(r'(20\d{2})[-_.]?(\d{2})[-_.]?(\d{2})')
+
+def open_snapshot_db(path=SNAPSHOT_DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SNAPSHOT_SCHEMA + ";" + SNAPSHOT_INGESTS_DDL + ";")
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SNAPSHOT_SCHEMA_VERSION: _migrate_snapshot_db(conn)
+    return conn
+
+def _migrate_snapshot_db(conn):
+    # v1 → v2: 快照行补来源列 (旧行为空, 不参与改日期搬迁); 导入登记改为每个 ingest_key 一条, 保留最近一次
+    # v2 → v3: 登记补 mapping_key 列. 旧登记的 ingest_key 是 文件+映射 的键, 还原不出文件哈希, 原样保留;
+    #          同一份文件再上传时按文件哈希重新登记, 同一天同一商品按主键覆盖, 不会重复
+    with conn:
+        if 'ingest_key' not in {r[1] for r in conn.execute("PRAGMA table_info(snapshots)")}:
+            conn.execute("ALTER TABLE snapshots ADD COLUMN ingest_key TEXT")
+        if [r[1] for r in conn.execute("PRAGMA table_info(snapshot_ingests)") if r[5]] != ['ingest_key']:
+            conn.execute("ALTER TABLE snapshot_ingests RENAME TO snapshot_ingests_v1")
+            conn.execute(SNAPSHOT_INGESTS_DDL)
+            conn.execute("""INSERT OR REPLACE INTO snapshot_ingests (ingest_key, snapshot_date, row_count, ingested_at)
+                            SELECT ingest_key, snapshot_date, row_count, ingested_at FROM snapshot_ingests_v1 ORDER BY ingested_at""")
+            conn.execute("DROP TABLE snapshot_ingests_v1")
+        if 'mapping_key' not in {r[1] for r in conn.execute("PRAGMA table_info(snapshot_ingests)")}:
+            conn.execute("ALTER TABLE snapshot_ingests ADD COLUMN mapping_key TEXT")
+        conn.execute(f"PRAGMA user_version = {SNAPSHOT_SCHEMA_VERSION}")
+
+def guess_snapshot_date(file_name):
+    match = SNAPSHOT_DATE_RE.search(file_name)
+    if match:
+        try: return datetime.date(*map(int, match.groups()))
+        except ValueError: pass
+    return datetime.date.today()
+
+def save_snapshot(main_df, col_name, snapshot_date, ingest_key, mapping_key):
+    # 每份文件 (ingest_key = 内容哈希) 只登记一次; 改了日期或字段映射 (mapping_key) 就把这份文件仍占有的行删掉重写,
+    # 不会同一份表存成两天, 也不会留下映射选错时写入的行. 同一天重复出现的商品以最新上传为准
+    # 返回 None (无改动) / "saved" / "moved" (改日期) / "replaced" (改映射)
+    day = snapshot_date.isoformat()
+    conn = open_snapshot_db()
+    try:
+        prev = conn.execute("SELECT snapshot_date, mapping_key FROM snapshot_ingests WHERE ingest_key = ?", (ingest_key,)).fetchone()
+        if prev == (day, mapping_key): return None
+        # 按主键顺序批量写入, B 树顺序追加比随机插入快得多; 列先转成 Python 原生类型再绑定
+        agg = main_df.groupby('Product_Key', sort=True).agg(
+            title=(col_name, 'first'), price=('Clean_Price', 'mean'), sales=('Clean_Sales', 'sum'),
+            gmv=('GMV', 'sum'), listings=('GMV', 'size'))
+        rows = zip(agg.index.tolist(), [day] * len(agg), agg['title'].astype(object).where(agg['title'].notna(), None).tolist(),
+                   agg['price'].astype(float).tolist(), agg['sales'].astype(float).tolist(), agg['gmv'].astype(float).tolist(),
+                   agg['listings'].astype(int).tolist(), [ingest_key] * len(agg))
+        with conn:
+            # 旧日期里已被后续上传覆盖的行归属别的导入, 不动
+            if prev: conn.execute("DELETE FROM snapshots WHERE snapshot_date = ? AND ingest_key = ?", (prev[0], ingest_key))
+            conn.executemany("""
+                INSERT INTO snapshots (product_key, snapshot_date, title, price, sales, gmv, listings, ingest_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (product_key, snapshot_date) DO UPDATE SET
+                    title = excluded.title, price = excluded.price, sales = excluded.sales, gmv = excluded.gmv,
+                    listings = excluded.listings, ingest_key = excluded.ingest_key
+            """, rows)
+            conn.execute("INSERT OR REPLACE INTO snapshot_ingests VALUES (?, ?, ?, ?, ?)",
+                         (ingest_key, day, len(main_df), datetime.datetime.now().isoformat(timespec='microseconds'), mapping_key))
+        return "saved" if not prev else "moved" if prev[0] != day else "replaced"
+    finally: conn.close()
+
+def snapshot_revision():
+    conn = open_snapshot_db()
+    # 改日期只更新登记的日期和时间, 导入数/天数可能不变, 所以带上最近写入时间
+    try: return conn.execute("SELECT COUNT(*), COUNT(DISTINCT snapshot_date), MAX(ingested_at) FROM snapshot_ingests").fetchone()
+    finally: conn.close()
+
+@st.cache_data(show_spinner=False)
+def load_trend_frame(snapshot_date, revision):
+    # 每个商品与它在库中上一次快照对比: 日均销量增速 + GMV 变化 (revision 变化即失效)
+    conn = open_snapshot_db()
     try:
+        trend = pd.read_sql_query("""
+            SELECT cur.product_key, cur.sales - prev.sales AS sales_diff, cur.gmv - prev.gmv AS GMV_Delta,
+                   julianday(cur.snapshot_date) - julianday(prev.snapshot_date) AS days
+            FROM snapshots cur
+            JOIN snapshots prev ON prev.product_key = cur.product_key AND prev.snapshot_date = (
+                SELECT MAX(p.snapshot_date) FROM snapshots p
+                WHERE p.product_key = cur.product_key AND p.snapshot_date < cur.snapshot_date)
+            WHERE cur.snapshot_date = ?
+        """, conn, params=(snapshot_date.isoformat(),))
+    finally: conn.close()
+    trend['Sales_Velocity'] = trend['sales_diff'] / trend['days']
+    return trend.set_index('product_key')[['Sales_Velocity', 'GMV_Delta']]
+
+@st.cache_data(show_spinner=False)
+def load_product_history(product_key, revision):
+    conn = open_snapshot_db()
+    try:
+        return pd.read_sql_query("SELECT snapshot_date, price, sales, gmv FROM snapshots WHERE product_key = ? ORDER BY snapshot_date",
+                                 conn, params=(int(product_key),), parse_dates=['snapshot_date'])
+    finally: conn.close()
+
+# --- 排序视图: 每个数据集只排序一次 (GMV 全局序 + 价格索引), 筛选只做掩码或二分查找 ---
+@st.cache_resource(max_entries=4, show_spinner=False)
+def build_rank_index(clean_key, _main_df):
+    price = _main_df['Clean_Price'].to_numpy()
+    sales = _main_df['Clean_Sales'].to_numpy()
+    gmv_order = np.argsort(-_main_df['GMV'].to_numpy(), kind='stable')
+    gmv_rank = np.empty(len(gmv_order), dtype=np.int64)
+    gmv_rank[gmv_order] = np.arange(len(gmv_order))
+    price_order = np.argsort(price, kind='stable')
+    return {"gmv_order": gmv_order, "gmv_rank": gmv_rank, "price_order": price_order, "price_sorted": price[price_order],
+            "sales": sales, "gmv_price": price[gmv_order], "gmv_sales": sales[gmv_order],
+            "id_index": pd.Index(_main_df['Product_Id'].to_numpy())}
+
+def lookup_product_pos(rank_index, product_id):
+    # Product_Id -> 行位置, 走 pandas 哈希索引, O(1)
+    try: loc = rank_index["id_index"].get_loc(product_id)
+    except KeyError: return None
+    if isinstance(loc, slice): return loc.start
+    if isinstance(loc, np.ndarray): return int(np.flatnonzero(loc)[0])
+    return loc
+
+def select_product(product_id):
+    # 切换商品时清空上一个商品的 AI 文案
+    if st.session_state.selected_product_id != product_id:
+        st.session_state.gen_keywords = ""
+        st.session_state.gen_title = ""
+        st.session_state.gen_desc = ""
+        st.session_state.gen_script = ""
+    st.session_state.selected_product_id = product_id
+
+def ranked_positions(rank_index, price_lo, price_hi, sales_min):
+    # 返回满足筛选的行位置, 已按 GMV 降序; 价格区间很窄时二分查找候选再按全局名次排序, 否则在 GMV 序上直接做掩码
+    lo = np.searchsorted(rank_index["price_sorted"], price_lo, side='left')
+    hi = np.searchsorted(rank_index["price_sorted"], price_hi, side='right')
+    if (hi - lo) * 8 < len(rank_index["price_order"]):
+        cand = rank_index["price_order"][lo:hi]
+        cand = cand[rank_index["sales"][cand] >= sales_min]
+        return cand[np.argsort(rank_index["gmv_rank"][cand], kind='stable')]
+    keep = (rank_index["gmv_price"] >= price_lo) & (rank_index["gmv_price"] <= price_hi) & (rank_index["gmv_sales"] >= sales_min)
+    return rank_index["gmv_order"][keep]
+
+def top_k_positions(values, k):
+    # 部分选择: argpartition 取前 k, 只对这 k 个排序
+    if len(values) <= k: return np.argsort(-values, kind='stable')
+    part = np.argpartition(-values, k - 1)[:k]
+    return part[np.argsort(-values[part], kind='stable')]
+
+# --- 全品类分布: 服务端把 价格 × 销量 二维分箱, 只有窗口内点数足够少时才下发原始点 ---
+DENSITY_BINS = (60, 40)
+DENSITY_RAW_LIMIT = 3000
+DENSITY_SALES_TICKS = [0, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def build_density_figure(view_key, color_by, _price, _sales, _gmv, _ids, _names):
+    # 销量按 log10(销量+1) 分箱; view_key/color_by 决定缓存, 下划线参数不参与哈希
+    price = _price.astype('float64')
+    log_sales = np.log10(_sales.astype('float64') + 1)
+    if len(price) <= DENSITY_RAW_LIMIT:
+        fig = go.Figure(go.Scattergl(
+            x=price, y=log_sales, mode='markers', customdata=np.column_stack([_ids.astype(str)]), hovertext=_names,
+            marker=dict(size=7, color=_gmv if color_by == "GMV" else None, colorscale="Viridis", showscale=color_by == "GMV", opacity=0.75),
+            hovertemplate="%{hovertext}<br>售价 $%{x:.2f}<extra></extra>"))
+        raw_points = True
+    else:
+        counts, x_edges, y_edges = np.histogram2d(price, log_sales, bins=DENSITY_BINS)
+        gmv_sum, _, _ = np.histogram2d(price, log_sales, bins=[x_edges, y_edges], weights=_gmv)
+        xi, yi = np.nonzero(counts)
+        value = gmv_sum[xi, yi] if color_by == "GMV" else counts[xi, yi]
+        sales_lo, sales_hi = 10 ** y_edges[yi] - 1, 10 ** y_edges[yi + 1] - 1
+        hover = [f"售价 ${a:,.2f} – ${b:,.2f}<br>销量 {c:,.0f} – {d:,.0f}<br>{int(n):,} 个商品 · GMV ${g:,.0f}"
+                 for a, b, c, d, n, g in zip(x_edges[xi], x_edges[xi + 1], sales_lo, sales_hi, counts[xi, yi], gmv_sum[xi, yi])]
+        fig = go.Figure(go.Scatter(
+            x=(x_edges[xi] + x_edges[xi + 1]) / 2, y=(y_edges[yi] + y_edges[yi + 1]) / 2, mode='markers',
+            customdata=np.column_stack([x_edges[xi], x_edges[xi + 1], sales_lo]), hovertext=hover, hovertemplate="%{hovertext}<extra></extra>",
+            marker=dict(symbol='square', size=11, color=np.log10(value + 1), colorscale="Viridis", showscale=True,
+                        colorbar=dict(title="log " + ("GMV" if color_by == "GMV" else "商品数")))))
+        raw_points = False
+    fig.update_layout(
+        height=420, margin=dict(l=20, r=20, t=30, b=40), dragmode='select', template="plotly_white",
+        plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)', font={'color': '#1D1D1F'},
+        xaxis_title="售价 ($)", yaxis_title="销量",
+        yaxis=dict(tickvals=np.log10(np.array(DENSITY_SALES_TICKS) + 1), ticktext=[f"{v:,}" for v in DENSITY_SALES_TICKS]))
+    return fig, raw_points
+
+def density_selection_filter(selection, raw_points):
+    # 框选/点选 -> (价格下限, 价格上限, 最低销量); 原始点模式下单击返回 None, 交给选品逻辑
+    if selection['box']:
+        box = selection['box'][0]
+        return min(box['x']), max(box['x']), max(10 ** min(box['y']) - 1, 0)
+    points = [p for p in selection['points'] if p.get('customdata')]
+    if not points or raw_points: return None
+    return (min(p['customdata'][0] for p in points), max(p['customdata'][1] for p in points), max(min(p['customdata'][2] for p in points), 0))
+
+# --- 同款聚类: 标题分词 → MinHash 签名 → LSH 分桶, 只校验同桶候选, 不做两两比较; 同一份词表建倒排索引供标题搜索 ---
+TITLE_HAN_PAT = r'(\p{Han})'  # RE2 语法, 汉字逐字成词, 其余按非字母数字切分
+MINHASH_PERMS = 32
+LSH_BANDS = 8  # 8 段 × 4 行, Jaccard ≈0.6 以上大概率落进同一桶
+DEDUP_MIN_JACCARD = 0.6
+DEDUP_SHORT_TOKENS = 8  # 少于 8 个词的短标题改 1 个词就掉到 0.75 以下, 需要更高的门槛
+DEDUP_SHORT_JACCARD = 0.8
+DEDUP_ESTIMATE_SLACK = 0.1  # 签名估计有误差, 粗筛放宽, 入簇前再算精确 Jaccard
+TITLE_NUM_PAT = r'\d'  # 含数字的词 (型号/尺寸/容量) 必须完全一致才算同款
+MINHASH_SEED = 20240601
+TITLE_SEARCH_LIMIT = 50
+TITLE_PREFIX_EXPAND = 32  # 查询词不在词表里时, 最多按前缀展开的词数
+
+def tokenize_titles(titles):
+    # -> (行号, 词 id, 词表); 整列走 Arrow 正则切分 + 字典编码, 词 id 即词表下标
+    norm = titles.astype('string[pyarrow]').fillna("").str.lower().str.replace(TITLE_HAN_PAT, r' \1 ', regex=True).str.strip()
+    norm = pa.array(norm)
+    if isinstance(norm, pa.ChunkedArray): norm = norm.combine_chunks()  # 分块流式清洗的结果是多块, 合并后行号才连续
+    lists = pc.split_pattern_regex(norm, SNAPSHOT_TITLE_PAT)
+    flat, rows = pc.list_flatten(lists), pc.list_parent_indices(lists)
+    keep = pc.not_equal(flat, "")
+    encoded = pc.dictionary_encode(flat.filter(keep))
+    return rows.filter(keep).to_numpy().astype(np.int64), encoded.indices.to_numpy().astype(np.int64), encoded.dictionary
+
+def minhash_signatures(rows, tokens, n_rows, n_vocab, perms=MINHASH_PERMS, seed=MINHASH_SEED):
+    # 每个排列只对词表求一次哈希 (乘移位哈希), 再按行段 minimum.reduceat; 无词的行签名为全 1, 不参与聚类
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, perms, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, perms, dtype=np.uint64)
+    vocab = np.arange(n_vocab, dtype=np.uint64)
+    has_tokens = np.bincount(rows, minlength=n_rows) > 0
+    starts = np.searchsorted(rows, np.flatnonzero(has_tokens))
+    sig = np.full((n_rows, perms), np.iinfo(np.uint32).max, dtype=np.uint32)
+    if len(rows):
+        with np.errstate(over='ignore'):
+            for p in range(perms):
+                hashed = ((a[p] * vocab + b[p]) >> np.uint64(32)).astype(np.uint32)
+                sig[has_tokens, p] = np.minimum.reduceat(hashed[tokens], starts)
+    return sig, has_tokens
+
+def title_token_sets(rows, tokens, n_rows, vocab):
+    # 每行去重后的词集, 按 (行, 词) 排序存成一维键, 供精确 Jaccard 二分查找; 另算每行含数字词集合的指纹
+    n_vocab = max(len(vocab), 1)
+    key = np.sort(rows * n_vocab + tokens)
+    key = key[np.r_[True, key[1:] != key[:-1]]] if len(key) else key
+    set_rows, set_tokens = key // n_vocab, key % n_vocab
+    counts = np.bincount(set_rows, minlength=n_rows)
+    numeric = pc.match_substring_regex(vocab, TITLE_NUM_PAT).to_numpy(zero_copy_only=False)[set_tokens]
+    token_hash = np.random.default_rng(MINHASH_SEED + 2).integers(1, 2**63, n_vocab, dtype=np.uint64)
+    num_fp = np.zeros(n_rows, dtype=np.uint64)
+    with np.errstate(over='ignore'): np.add.at(num_fp, set_rows[numeric], token_hash[set_tokens[numeric]])
+    return {"key": key, "n_vocab": n_vocab, "starts": np.r_[0, np.cumsum(counts)], "counts": counts, "num_fp": num_fp}
+
+def _dedup_threshold(sets, u, v):
+    return np.where(np.minimum(sets["counts"][u], sets["counts"][v]) < DEDUP_SHORT_TOKENS, DEDUP_SHORT_JACCARD, DEDUP_MIN_JACCARD)
+
+def exact_title_match(sets, u, v):
+    # 精确 Jaccard: 展开 u 的词, 到 v 的词集里二分查找; 数字词指纹不同直接判不同款
+    cu = sets["counts"][u]
+    pair_idx = np.repeat(np.arange(len(u)), cu)
+    offset = np.arange(cu.sum()) - np.repeat(np.cumsum(cu) - cu, cu)
+    u_tokens = sets["key"][np.repeat(sets["starts"][u], cu) + offset] % sets["n_vocab"]
+    probe = np.repeat(v, cu) * sets["n_vocab"] + u_tokens
+    pos = np.minimum(np.searchsorted(sets["key"], probe), max(len(sets["key"]) - 1, 0))
+    inter = np.bincount(pair_idx, weights=sets["key"][pos] == probe, minlength=len(u))
+    union = cu + sets["counts"][v] - inter
+    jaccard = np.divide(inter, union, out=np.zeros(len(u)), where=union > 0)
+    return (jaccard >= _dedup_threshold(sets, u, v)) & (sets["num_fp"][u] == sets["num_fp"][v])
+
+def lsh_candidate_pairs(sig, has_tokens, bands=LSH_BANDS):
+    # 每段签名合成一个桶键, 排序后同键连成 (成员, 桶首) 候选对
+    r = sig.shape[1] // bands
+    mix = np.random.default_rng(MINHASH_SEED + 1).integers(1, 2**63, r, dtype=np.uint64) | np.uint64(1)
+    cand = np.flatnonzero(has_tokens)
+    if len(cand) < 2: return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    us, vs = [], []
+    with np.errstate(over='ignore'):
+        for band in range(bands):
+            key = (sig[cand, band * r:(band + 1) * r].astype(np.uint64) * mix).sum(axis=1)
+            order = np.argsort(key, kind='stable')
+            sorted_key = key[order]
+            starts = np.r_[True, sorted_key[1:] != sorted_key[:-1]]
+            leader = order[np.flatnonzero(starts)[np.cumsum(starts) - 1]]
+            us.append(cand[order[~starts]]); vs.append(cand[leader[~starts]])
+    return np.concatenate(us), np.concatenate(vs)
+
+def _min_label_components(n, u, v):
+    # 连通分量: 边两端取较小标签 + 指针跳跃, 收敛后标签 = 分量内最小行号
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[u], labels[v])
+        nxt = labels.copy()
+        np.minimum.at(nxt, u, low); np.minimum.at(nxt, v, low)
+        nxt = nxt[nxt]
+        if np.array_equal(nxt, labels): return labels
+        labels = nxt
+
+def lsh_cluster_labels(sig, has_tokens, sets, bands=LSH_BANDS):
+    n = sig.shape[0]
+    u, v = lsh_candidate_pairs(sig, has_tokens, bands)
+    n_pairs = len(u)
+    keep = (((sig[u] == sig[v]).mean(axis=1) >= _dedup_threshold(sets, u, v) - DEDUP_ESTIMATE_SLACK)
+            & (sets["num_fp"][u] == sets["num_fp"][v]))
+    u, v = u[keep], v[keep]
+    # 不做传递合并: 连通分量只用来选代表 (分量内最小行号), 成员必须与代表本身精确匹配才入簇, 避免 A≈B≈C 把 A、C 串成一款;
+    # 没通过的成员只在彼此之间的剩余边上重新分组, 每轮至少去掉各分量代表的边, 一定收敛
+    labels = np.arange(n)
+    while len(u):
+        comp = _min_label_components(n, u, v)
+        member = np.flatnonzero(comp != np.arange(n))
+        ok = exact_title_match(sets, member, comp[member])
+        labels[member[ok]] = comp[member[ok]]
+        failed = np.zeros(n, dtype=bool)
+        failed[member[~ok]] = True
+        live = failed[u] & failed[v]
+        u, v = u[live], v[live]
+    return labels, n_pairs
+
+def index_titles(titles):
+    titles = titles.reset_index(drop=True)
+    n = len(titles)
+    rows, tokens, vocab = tokenize_titles(titles)
+    sig, has_tokens = minhash_signatures(rows, tokens, n, len(vocab))
+    labels, n_pairs = lsh_cluster_labels(sig, has_tokens, title_token_sets(rows, tokens, n, vocab))
+    # 倒排表: (词, 行) 去重后按词排序, indptr 为各词的起止; np.unique 走哈希较慢, 这里用排序 + 相邻比较
+    pair = np.sort(tokens * max(n, 1) + rows)
+    pair = pair[np.r_[True, pair[1:] != pair[:-1]]] if len(pair) else pair
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair // max(n, 1), minlength=len(vocab)), out=indptr[1:])
+    vocab_arr = np.array(vocab.to_pylist(), dtype=object)
+    vocab_order = np.argsort(vocab_arr, kind='stable')
+    return {"n": n, "labels": labels, "cluster_size": np.bincount(labels, minlength=n)[labels], "n_pairs": n_pairs,
+            "post_rows": (pair % max(n, 1)).astype(np.int32), "indptr": indptr,
+            "vocab_sorted": vocab_arr[vocab_order], "vocab_order": vocab_order}
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def build_title_index(clean_key, _titles):
+    return index_titles(_titles)
+
+def search_titles(title_index, query, gmv_rank, limit=TITLE_SEARCH_LIMIT):
+    # 查询词命中的行累加 IDF 得分, 同分按 GMV 名次; 词表里没有的词按前缀展开 (如 "lamp" → "lamps")
+    _, _, terms = tokenize_titles(pd.Series([query]))
+    scores = np.zeros(title_index["n"], dtype=np.float32)
+    vocab_sorted, vocab_order, post_rows, indptr = (title_index[k] for k in ("vocab_sorted", "vocab_order", "post_rows", "indptr"))
+    for term in terms.to_pylist():
+        lo = np.searchsorted(vocab_sorted, term, side='left')
+        if lo < len(vocab_sorted) and vocab_sorted[lo] == term: ids = vocab_order[lo:lo + 1]
+        else: ids = vocab_order[lo:np.searchsorted(vocab_sorted, term + "￿", side='right')][:TITLE_PREFIX_EXPAND]
+        if not len(ids): continue
+        hits = np.concatenate([post_rows[indptr[i]:indptr[i + 1]] for i in ids])
+        if len(ids) > 1:
+            hits = np.sort(hits)
+            hits = hits[np.r_[True, hits[1:] != hits[:-1]]]
+        scores[hits] += np.log((title_index["n"] + 1) / (len(hits) + 1)) + 1
+    cand = np.flatnonzero(scores)
+    top = cand[np.lexsort((gmv_rank[cand], -scores[cand]))][:limit]
+    return top, scores[top]
+
+def cluster_rollup(view_df, cluster_ids, col_name):
+    # view_df 已按 GMV 降序, 每簇第一行即代表款
+    grouped = view_df.assign(Cluster_Id=cluster_ids, Clean_Sales=view_df['Clean_Sales'].astype('float64')).groupby('Cluster_Id', sort=False)
+    rollup = grouped.agg(Title=(col_name, 'first'), Product_Id=('Product_Id', 'first'), Listings=('GMV', 'size'),
+                         Cluster_Sales=('Clean_Sales', 'sum'), Cluster_GMV=('GMV', 'sum'),
+                         Price_Min=('Clean_Price', 'min'), Price_Max=('Clean_Price', 'max'))
+    return rollup.sort_values('Cluster_GMV', ascending=False, kind='stable').reset_index(drop=True)
+
+# 探针: (标题组, 是否同款); 型号/容量/颜色不同的短标题必须各自成簇, 只差大小写标点的必须合并
+TITLE_VARIANT_PROBES = [
+    ([f"iPhone {m} Case Clear Shockproof" for m in range(11, 17)], False),
+    (["Kids Toy Car Red", "Kids Toy Car Blue", "Kids Toy Truck Blue"], False),
+    (["Stanley Tumbler 40oz", "Stanley Tumbler 30oz", "Stanley Tumbler 20oz"], False),
+    ([f"Item {k} cool gadget" for k in (14, 140, 1498)], False),
+    (["LED Desk Lamp White Touch Dimmable", "led desk lamp - WHITE, touch dimmable!"], True),
+    (["Portable Blender USB Rechargeable 380ml Smoothie Cup Travel Juicer Mini",
+      "Portable Blender USB Rechargeable 380ml Smoothie Cup Travel Juicer Pink"], True),
+]
+
+def title_probe_errors(labels):
+    # labels 为探针标题 (按 TITLE_VARIANT_PROBES 顺序拼接) 的簇标签, 返回判错的组数
+    errors, start = 0, 0
+    for group, same in TITLE_VARIANT_PROBES:
+        n_labels = len(set(labels[start:start + len(group)].tolist()))
+        errors += (n_labels != 1) if same else (n_labels != len(group))
+        start += len(group)
+    return errors
+
+def benchmark_title_index(sizes=(50_000, 100_000, 200_000, 500_000), seed=0, n_queries=20):
+    # 合成数据: 每款商品 ~8 条链接, 半数链接随机改写 1 个词, 模拟多卖家同款不同标题; 末尾追加型号变体探针
+    rng = np.random.default_rng(seed)
+    # 合成词只用字母: 含数字的词按型号处理, 会让改写过的链接全部判成不同款
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = np.array(["".join(letters[i // 26**k % 26] for k in range(4)) for i in range(20_000)] + list("美白保湿防晒精华面膜口红"), dtype=object)
+    rows = []
+    for n in sizes:
+        n_products = max(n // 8, 1)
+        product = rng.integers(0, n_products, n)
+        tokens = rng.integers(0, len(words), (n_products, 10))[product]
+        swap = rng.random(n) < 0.5
+        tokens[swap, rng.integers(0, 10, swap.sum())] = rng.integers(0, len(words), swap.sum())
+        probes = [title for group, _ in TITLE_VARIANT_PROBES for title in group]
+        titles = pd.Series([" ".join(t) for t in words[tokens]] + probes, dtype='string[pyarrow]')
+        t0 = time.perf_counter(); idx = index_titles(titles); t_build = time.perf_counter() - t0
+        labels = idx["labels"][:n]
+        queries = [" ".join(words[rng.integers(0, len(words), 2)]) for _ in range(n_queries)]
+        gmv_rank = rng.permutation(n)
+        t0 = time.perf_counter()
+        for q in queries: search_titles(idx, q, gmv_rank)
+        t_search = (time.perf_counter() - t0) / n_queries
+        purity = pd.Series(product).groupby([labels, product]).size().groupby(level=0).max().sum() / n
+        rows.append({"行数": n, "建索引(s)": round(t_build, 2), "行/秒": int(n / t_build) if t_build > 0 else None,
+                     "LSH 候选对": idx["n_pairs"], "两两比较对": n * (n - 1) // 2, "聚类数": int((labels == np.arange(n)).sum()),
+                     "真实款数": int(len(np.unique(product))), "簇纯度": round(purity, 4), "搜索均值(ms)": round(t_search * 1000, 1),
+                     "变体探针判错": title_probe_errors(idx["labels"][n:])})
+    return pd.DataFrame(rows)
+
+# --- 利润模型 (规则与计算见 tk_core): 同一数据集 + 规则只算一次 ---
+LIST_SORT_OPTIONS = {"GMV": "GMV", "预估利润": "Profit", "利润率": "Margin", "利润 GMV": "Profit_GMV"}
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def build_profit_columns(clean_key, rules, _price, _sales):
+    return profit_columns(_price, _sales, rules)
+
+# --- AI 响应缓存: 按 (归一化提示词, 模型, 温度) 落盘到 SQLite, TTL + 按体积 LRU 淘汰, 跨会话共享 ---
+LLM_CACHE_PATH = os.path.join(".cache", "llm_cache.sqlite3")
+LLM_CACHE_TTL_DAYS = 7
+LLM_CACHE_MAX_MB = 64
+
+class LLMCache:
+    def __init__(self, path, ttl_seconds, max_bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY, model TEXT, temperature REAL, response TEXT,
+                size INTEGER, created_at REAL, last_used REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used);
+        """)
+
+    @staticmethod
+    def make_key(prompt, model, temp):
+        norm = " ".join(prompt.split())
+        return hashlib.blake2b(f"{model}|{round(float(temp), 2)}|{norm}".encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, prompt, model, temp):
+        key, now = self.make_key(prompt, model, temp), time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM llm_cache WHERE cache_key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                with self._conn: self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE cache_key = ?", (now, key))
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, prompt, model, temp, response):
+        now, size = time.time(), len(response.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (self.make_key(prompt, model, temp), model, round(float(temp), 2), response, size, now, now))
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > self.max_bytes:
+                # 从最久未用的开始删, 直到回到上限以内
+                for key, item_size in self._conn.execute("SELECT cache_key, size FROM llm_cache ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes: break
+                    self._conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                    total -= item_size
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size_mb": total / 2**20}
+
+    def clear(self):
+        with self._lock, self._conn: self._conn.execute("DELETE FROM llm_cache")
+
+@st.cache_resource
+def get_llm_cache():
+    return LLMCache(LLM_CACHE_PATH, LLM_CACHE_TTL_DAYS * 86400, LLM_CACHE_MAX_MB * 2**20)
+
+ONESHOT_FIELDS = {"keywords": "关键词", "title": "SEO 标题", "description": "商品描述", "script": "视频脚本"}
+
+# --- 流式渲染: 分片先进缓冲区, 按时间预算重绘, 同时记录每次调用的 TTFT / 总耗时 / 分片数 / tokens/s ---
+AI_STREAM_RENDER_INTERVAL = 0.1  # 秒, 两次重绘的最小间隔
+AI_METRICS_HISTORY = 200
+
+@st.cache_resource
+def get_ai_metrics():
+    return deque(maxlen=AI_METRICS_HISTORY)
+
+class StreamRenderer:
+    def __init__(self, render, kind, interval=AI_STREAM_RENDER_INTERVAL):
+        self.render = render  # render(text, final)
+        self.kind = kind
+        self.interval = interval
+        self.parts = []
+        self.chunks = 0
+        self.usage_tokens = None
+        self.started_at = time.perf_counter()
+        self.first_at = None
+        self._drawn_at = 0.0
+
+    @property
+    def text(self): return "".join(self.parts)
+
+    def add(self, chunk):
+        # chunk 为流式响应的一个分片; 服务端在最后一片附带 usage 时用真实 token 数
+        usage = getattr(chunk, 'usage', None)
+        if usage and usage.completion_tokens: self.usage_tokens = usage.completion_tokens
+        content = chunk.choices[0].delta.content if chunk.choices else None
+        if not content: return None
+        now = time.perf_counter()
+        if self.first_at is None: self.first_at = now
+        self.parts.append(content)
+        self.chunks += 1
+        if now - self._drawn_at >= self.interval:
+            self.render(self.text, False)
+            self._drawn_at = time.perf_counter()
+        return content
+
+    def finish(self):
+        text = self.text
+        self.render(text, True)
+        total = time.perf_counter() - self.started_at
+        tokens = self.usage_tokens or self.chunks
+        gen_time = total - (self.first_at - self.started_at) if self.first_at else 0.0
+        get_ai_metrics().append({
+            "时间": datetime.datetime.now().strftime("%H:%M:%S"), "类型": self.kind,
+            "TTFT(s)": round(self.first_at - self.started_at, 3) if self.first_at else None,
+            "总耗时(s)": round(total, 3), "分片数": self.chunks, "tokens": tokens,
+            "tokens/s": round(tokens / gen_time, 1) if gen_time > 0 else None, "字符数": len(text),
+        })
+        return text
+
+def stream_ai_fields(client, prompt, slots, temp=1.3, refresh=False):
+    # 单次请求生成多个字段: slots 为 {字段: st.empty()}, 每个字段的内容一到就填进对应占位
+    llm_cache = get_llm_cache()
+    cached = None if refresh else llm_cache.get(prompt, AI_MODEL, temp)
+    parser = JsonFieldStream()
+    try:
+        if cached is not None: full_text = cached; parser.feed(cached)
+        else:
+            dirty = set()
+            def render_fields(_text, final):
+                for field in dirty:
+                    if field in slots and not final: slots[field].markdown(f"**{ONESHOT_FIELDS.get(field, field)}**\n\n{parser.values[field]}▌")
+                dirty.clear()
+            renderer = StreamRenderer(render_fields, "一键")
+            stream = client.chat.completions.create(
+                model=AI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                response_format={"type": "json_object"},
+                stream=True,
+                stream_options={"include_usage": True},
+                temperature=temp
+            )
+            for chunk in stream:
+                content = renderer.add(chunk)
+                if content: dirty.update(parser.feed(content))
+            full_text = renderer.finish()
+        fields = parser.finish(full_text)
+        for field, slot in slots.items(): slot.markdown(f"**{ONESHOT_FIELDS.get(field, field)}**\n\n{fields.get(field, '')}")
+        if cached is None and all(fields.get(f) for f in slots): llm_cache.put(prompt, AI_MODEL, temp, full_text)
+        return fields
+    except Exception as e:
+        next(iter(slots.values())).error(_ai_error_message(e))
+        return {}
+
+def _ai_error_message(e):
+    err_str = str(e)
+    if "Insufficient Balance" in err_str or "402" in err_str:
+        return "❌ 余额不足 (Error 402): 请去 DeepSeek 官网充值 (只需几块钱)。"
+    return f"❌ AI 请求失败: {err_str}"
+
+def stream_ai_response(client, prompt, placeholder_obj, temp=1.3, refresh=False):
+    # refresh=True 跳过缓存读取 (重新生成), 新结果仍会写回缓存
+    llm_cache = get_llm_cache()
+    cached = None if refresh else llm_cache.get(prompt, AI_MODEL, temp)
+    if cached is not None:
+        placeholder_obj.markdown(cached)
+        return cached
+    try:
+        renderer = StreamRenderer(lambda text, final: placeholder_obj.markdown(text if final else text + "▌"), "单步")
         stream = client.chat.completions.create(
-            model="deepseek-chat", 
+            model=AI_MODEL, 
             messages=[{"role": "user", "content": prompt}],
             stream=True,
+            stream_options={"include_usage": True},
             temperature=temp 
         )
-        full_text = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                full_text += content
-                placeholder_obj.markdown(full_text + "▌") 
-        placeholder_obj.markdown(full_text)
+        for chunk in stream: renderer.add(chunk)
+        full_text = renderer.finish()
+        if full_text: llm_cache.put(prompt, AI_MODEL, temp, full_text)
         return full_text
     except Exception as e:
-        err_str = str(e)
-        if "Insufficient Balance" in err_str or "402" in err_str:
-            err_msg = "❌ 余额不足 (Error 402): 请去 DeepSeek 官网充值 (只需几块钱)。"
-        else:
-            err_msg = f"❌ AI 请求失败: {err_str}"
+        err_msg = _ai_error_message(e)
         placeholder_obj.error(err_msg)
         return err_msg
 
+def results_to_xlsx_bytes(df):
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
 # ==========================================
 # 2. 侧边栏与 API (Boss 优化版)
 # ==========================================
@@ -147,49 +876,146 @@ ai_temp = st.sidebar.slider("🌡️ AI 创造力", 0.5, 1.8, 1.3, step=0.1)
 
 if active_api_key:
     try:
-        client = OpenAI(api_key=active_api_key, base_url="https://api.deepseek.com")
+        client = OpenAI(api_key=active_api_key, base_url=AI_BASE_URL)
         is_ai_ready = True
     except Exception as e:
         st.sidebar.error(f"Key 错误: {e}")
 
 st.sidebar.markdown("---")
 
+# --- 👑 Boss 工具: 解析性能基准 / AI 缓存 ---
+if st.session_state.user_role == 'admin':
+    with st.sidebar.expander("🗃️ AI 响应缓存", expanded=False):
+        llm_stats = get_llm_cache().stats()
+        k1, k2 = st.columns(2)
+        k1.metric("命中", llm_stats["hits"])
+        k2.metric("未命中", llm_stats["misses"])
+        st.caption(f"{llm_stats['entries']} 条 / {llm_stats['size_mb']:.2f} MB · TTL {LLM_CACHE_TTL_DAYS} 天")
+        if st.button("清空缓存", key="btn_clear_llm_cache"): get_llm_cache().clear(); st.rerun()
+    with st.sidebar.expander("⏱️ AI 流式诊断", expanded=False):
+        ai_calls = pd.DataFrame(list(get_ai_metrics()))
+        if ai_calls.empty: st.caption("暂无流式调用记录")
+        else:
+            k1, k2 = st.columns(2)
+            k1.metric("TTFT 中位数", f"{ai_calls['TTFT(s)'].median():.2f}s")
+            k2.metric("tokens/s 中位数", f"{ai_calls['tokens/s'].median():.1f}")
+            st.dataframe(ai_calls.iloc[::-1], hide_index=True, height=240)
+    with st.sidebar.expander("🧪 解析性能基准", expanded=False):
+        bench_rows = st.select_slider("合成行数", options=[100_000, 500_000, 1_000_000], value=1_000_000)
+        if st.button("运行基准", key="btn_bench_currency"):
+            with st.spinner("逐行 apply vs 向量化解析..."):
+                st.dataframe(benchmark_currency_parsing(bench_rows), hide_index=True)
+    with st.sidebar.expander("🧬 同款索引基准", expanded=False):
+        dedup_sizes = st.multiselect("合成行数", [50_000, 100_000, 200_000, 500_000], default=[50_000, 100_000, 200_000, 500_000])
+        if st.button("运行基准", key="btn_bench_title_index"):
+            with st.spinner("MinHash/LSH 建索引 + 搜索..."):
+                st.dataframe(benchmark_title_index(tuple(sorted(dedup_sizes))), hide_index=True)
+
+perf_panel = st.sidebar.container() if st.session_state.user_role == 'admin' else None
+rerun_timer.lap("鉴权/侧边栏")
+
 # ==========================================
 # 3. 文件上传与数据处理
 # ==========================================
 uploaded_file = st.sidebar.file_uploader("📂 上传 Kalodata/EchoTik 表格", type=["xlsx", "csv"])
 
 if uploaded_file:
-    try:
-        if uploaded_file.name.endswith('.csv'): df = pd.read_csv(uploaded_file)
-        else: df = pd.read_excel(uploaded_file)
-    except: st.error("文件格式错误"); st.stop()
+    ingest_cache = get_ingest_cache()
+    # 同一次上传只哈希一次: file_id + size 不变就沿用上次的内容哈希, 普通 rerun 不再扫描整份文件
+    upload_sig = (uploaded_file.file_id, uploaded_file.size)
+    if st.session_state.get('upload_sig') != upload_sig:
+        st.session_state.upload_hash = file_content_hash(uploaded_file)
+        st.session_state.upload_sig = upload_sig
+    file_hash = st.session_state.upload_hash
+    sniff_key = ingest_cache_key("sniff", file_hash)
+    df = ingest_cache.get(sniff_key)
+    if df is None:
+        try: df = ingest_cache.put(sniff_key, sniff_uploaded_table(uploaded_file, uploaded_file.name))
+        except: st.error("文件格式错误"); st.stop()
 
     cols = list(df.columns)
     with st.sidebar.expander("🔧 字段校准", expanded=True):
-        guess_name = next((c for c in cols if 'Title' in c or '名称' in c or 'Name' in c), cols[0])
-        guess_price = next((c for c in cols if 'Price' in c or '价格' in c), cols[1] if len(cols)>1 else cols[0])
-        guess_sales = next((c for c in cols if 'Sales' in c or '销量' in c), cols[2] if len(cols)>2 else cols[0])
-        guess_img = next((c for c in cols if 'Image' in c or 'Img' in c or 'Pic' in c or '图' in c or 'Cover' in c), None)
+        guess_name, guess_price, guess_sales, guess_img = guess_columns(cols)
 
         col_name = st.selectbox("商品标题列", cols, index=cols.index(guess_name))
         col_price = st.selectbox("价格列", cols, index=cols.index(guess_price))
         col_sales = st.selectbox("销量列", cols, index=cols.index(guess_sales))
-        col_img = st.selectbox("图片列 (可选)", ["无"] + cols, index=(cols.index(guess_img) + 1) if guess_img else 0)
+        col_img = st.selectbox("图片列 (可选)", ["无"] + cols, index=(cols.index(guess_img) + 1) if guess_img != "无" else 0)
     
-    main_df = df.copy()
-    main_df['Clean_Price'] = main_df[col_price].apply(clean_currency)
-    main_df['Clean_Sales'] = main_df[col_sales].apply(clean_currency)
-    main_df['GMV'] = main_df['Clean_Price'] * main_df['Clean_Sales']
+    clean_key = ingest_cache_key("clean", file_hash, col_name, col_price, col_sales, col_img)
+    main_df = ingest_cache.get(clean_key)
+    if main_df is None:
+        load_bar = st.progress(0.0, text="📥 正在流式解析表格...")
+        try:
+            main_df = stream_clean_frame(uploaded_file, uploaded_file.name, cols, col_name, col_price, col_sales, col_img,
+                                         on_progress=lambda frac, n: load_bar.progress(frac, text=f"📥 已解析 {n:,} 行"))
+        except: load_bar.empty(); st.error("文件格式错误"); st.stop()
+        load_bar.empty()
+        main_df = ingest_cache.put(clean_key, main_df)
     has_image = col_img != "无"
-    if has_image: main_df['Image_Url'] = main_df[col_img].astype(str)
+    rerun_timer.lap("读取/清洗")
+
+    # --- 历史快照: 自动入库, 再用索引查询与上一期对比 ---
+    with st.sidebar.expander("🗂️ 历史快照", expanded=False):
+        snapshot_date = st.date_input("本表数据日期", value=guess_snapshot_date(uploaded_file.name))
+        with st.spinner("写入快照库..."):
+            snapshot_status = save_snapshot(main_df, col_name, snapshot_date, file_hash, clean_key)
+        if snapshot_status: st.success(f"已{SNAPSHOT_STATUS_TEXT[snapshot_status]} {snapshot_date} 快照")
+        snapshot_rev = snapshot_revision()
+        st.caption(f"库内共 {snapshot_rev[1]} 天快照 / {snapshot_rev[0]} 次导入")
+    trend_df = load_trend_frame(snapshot_date, snapshot_rev)
+    has_trend = not trend_df.empty
+    if has_trend:
+        main_df = main_df.assign(
+            Sales_Velocity=main_df['Product_Key'].map(trend_df['Sales_Velocity']).astype('float32'),
+            GMV_Delta=main_df['Product_Key'].map(trend_df['GMV_Delta']))
+    rerun_timer.lap("快照库")
 
     min_p, max_p = int(main_df['Clean_Price'].min()), int(main_df['Clean_Price'].max())
     if min_p == max_p: max_p += 1
-    price_range = st.sidebar.slider("💰 价格区间", min_p, max_p, (min_p, max_p))
-    sales_min = st.sidebar.number_input("🔥 最低销量", min_value=0, value=100)
-    filtered_df = main_df[(main_df['Clean_Price'] >= price_range[0]) & (main_df['Clean_Price'] <= price_range[1]) & (main_df['Clean_Sales'] >= sales_min)]
-    max_gmv = filtered_df['GMV'].max() if not filtered_df.empty else 1
+    # 筛选控件带 key, 以便分布图的框选写回; 换数据集时回到全价格区间
+    if st.session_state.get('filter_dataset') != clean_key:
+        st.session_state.filter_dataset = clean_key
+        st.session_state.flt_price_range = (min_p, max_p)
+        st.session_state.flt_sales_min = 100
+    pending_filter = st.session_state.pop('pending_filter', None)
+    if pending_filter:
+        lo = min(max(int(np.floor(pending_filter[0])), min_p), max_p)
+        st.session_state.flt_price_range = (lo, max(min(int(np.ceil(pending_filter[1])), max_p), lo))
+        st.session_state.flt_sales_min = int(pending_filter[2])
+    price_range = st.sidebar.slider("💰 价格区间", min_p, max_p, key="flt_price_range")
+    sales_min = st.sidebar.number_input("🔥 最低销量", min_value=0, key="flt_sales_min")
+    margin_min = st.sidebar.slider("📈 最低利润率 (%)", -100, 100, -100, help="-100 表示不按利润率筛选")
+    with st.sidebar.expander("🧮 利润规则", expanded=False):
+        cost_pct = st.slider("进货成本 (% 售价)", 0, 100, DEFAULT_COST_PCT)
+        fee_pct = st.slider("平台佣金 (%)", 0.0, 20.0, DEFAULT_PLATFORM_FEE_PCT, step=0.5)
+        st.caption("头程运费档位: 售价 ≤ 上限取该档运费, 超出最后一档按最后一档")
+        ship_tiers = st.data_editor(pd.DataFrame(DEFAULT_SHIP_TIERS, columns=["售价上限", "运费"]), num_rows="dynamic",
+                                    hide_index=True, use_container_width=True, key="ship_tiers")
+    profit_rules = profit_rules_from_inputs(cost_pct, fee_pct, ship_tiers)
+    profit_cols = build_profit_columns(clean_key, profit_rules, main_df['Clean_Price'].to_numpy(), main_df['Clean_Sales'].to_numpy())
+    main_df = main_df.assign(**profit_cols)
+    # filtered_df 按 GMV 降序排列, 卡片/清单/选中行全部复用这一份顺序
+    view_key = (clean_key, tuple(price_range), sales_min, margin_min, profit_rules)
+    rank_index = build_rank_index(clean_key, main_df)
+    if st.session_state.get('ranked_view_key') != view_key:
+        view_pos = ranked_positions(rank_index, price_range[0], price_range[1], sales_min)
+        if margin_min > -100: view_pos = view_pos[profit_cols["Margin"][view_pos] >= margin_min]
+        st.session_state.ranked_view_pos = view_pos
+        st.session_state.ranked_view_key = view_key
+    filtered_df = main_df.iloc[st.session_state.ranked_view_pos]
+    max_gmv = filtered_df['GMV'].iat[0] if not filtered_df.empty else 1
+    rerun_timer.lap("筛选/排序")
+
+    with st.spinner("正在建立同款索引..."):
+        title_index = build_title_index(clean_key, main_df[col_name])
+    # 同款汇总只随筛选池变化, 与 ranked_view_pos 一起按 view_key 存, 搜索/点选等 rerun 不再重算
+    if st.session_state.get('cluster_view_key') != view_key:
+        view_clusters = title_index["labels"][st.session_state.ranked_view_pos]
+        st.session_state.cluster_view_rollup = cluster_rollup(filtered_df, view_clusters, col_name).head(200)
+        st.session_state.cluster_view_count = len(pd.unique(view_clusters))
+        st.session_state.cluster_view_key = view_key
+    rerun_timer.lap("同款索引")
 
     # ==========================================
     # 4. 主界面
@@ -200,13 +1026,13 @@ if uploaded_file:
     avg_price = filtered_df['Clean_Price'].mean()
     m1.metric("筛选池总 GMV", f"${filtered_df['GMV'].sum():,.0f}")
     m2.metric("平均客单价", f"${avg_price:.2f}")
-    m3.metric("潜力爆款数", len(filtered_df))
+    m3.metric("潜力爆款数", len(filtered_df), delta=f"去重后 {st.session_state.cluster_view_count:,} 款", delta_color="off")
     m4.metric("最高单品销量", f"{filtered_df['Clean_Sales'].max():,.0f}")
     st.markdown("<br>", unsafe_allow_html=True)
 
     # Top 3
     st.subheader("🔥 Top 3 推荐")
-    top_3_df = filtered_df.sort_values('GMV', ascending=False).head(3)
+    top_3_df = filtered_df.head(3)
     if len(top_3_df) >= 3:
         t1, t2, t3 = st.columns(3)
         for i, (col, icon) in enumerate(zip([t1, t2, t3], ["🥇", "🥈", "🥉"])):
@@ -224,24 +1050,24 @@ if uploaded_file:
                 </div>
                 """, unsafe_allow_html=True)
                 if st.button(f"🔍 分析这款", key=f"btn_top_{i}", use_container_width=True):
-                    st.session_state.selected_product_title = row[col_name]
-                    st.session_state.gen_keywords = ""
-                    st.session_state.gen_title = ""
-                    st.session_state.gen_desc = ""
+                    select_product(int(row['Product_Id']))
                     st.rerun()
     st.markdown("<br>", unsafe_allow_html=True)
 
+    rerun_timer.lap("指标/Top3")
+
     # --- 📊 交互式柱状图 (回归版) ---
     with st.container():
         st.markdown('<div class="glass-card">', unsafe_allow_html=True)
         st.subheader("📊 畅销品销量排行 (点击柱子查看分析)")
         if not filtered_df.empty:
-            chart_df = filtered_df.sort_values('Clean_Sales', ascending=False).head(50).copy()
+            chart_df = filtered_df.iloc[top_k_positions(filtered_df['Clean_Sales'].to_numpy(), 50)].copy()
             chart_df['Short_Name'] = chart_df[col_name].astype(str).apply(lambda x: x[:15] + '..' if len(x)>15 else x)
+            chart_df['Product_Ref'] = chart_df['Product_Id'].astype(str)  # 64 位 ID 以字符串传给前端, 避免 JS 浮点丢精度
             
             fig = px.bar(
                 chart_df, x='Short_Name', y='Clean_Sales', color='Clean_Price',
-                hover_name=col_name, template="plotly_white", color_continuous_scale="Viridis",
+                hover_name=col_name, custom_data=['Product_Ref'], template="plotly_white", color_continuous_scale="Viridis",
             )
             fig.update_layout(
                 height=400, margin=dict(l=20,r=20,t=30,b=50), 
@@ -250,42 +1076,129 @@ if uploaded_file:
             )
             # 关键：开启点击事件
             selected_points = st.plotly_chart(fig, use_container_width=True, on_select="rerun")
-            if selected_points and selected_points['selection']['points']:
-                point_idx = selected_points['selection']['points'][0]['point_index']
-                clicked_product = chart_df.iloc[point_idx][col_name]
-                st.session_state.selected_product_title = clicked_product
+            bar_points = selected_points['selection']['points'] if selected_points else []
+            bar_sig = json.dumps(bar_points, sort_keys=True, default=str)
+            # 点选状态会跨 rerun 保留, 只处理新的点选 (取消选中也记下), 否则会盖掉之后 Top3/清单的选择
+            if bar_sig != st.session_state.bar_handled_sel:
+                st.session_state.bar_handled_sel = bar_sig
+                if bar_points:
+                    point = bar_points[0]
+                    clicked_id = point['customdata'][0] if point.get('customdata') else chart_df['Product_Id'].iat[point['point_index']]
+                    select_product(int(clicked_id))
+        st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown("<br>", unsafe_allow_html=True)
+    rerun_timer.lap("Plotly 图表")
+
+    # --- 🗺️ 全品类 价格 × 销量 分布 (框选即筛选) ---
+    with st.container():
+        st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+        st.subheader("🗺️ 全品类价格 × 销量分布 (框选区域即筛选)")
+        g1, g2 = st.columns([3, 1])
+        density_color = g1.radio("着色", ["商品数", "GMV"], horizontal=True, key="density_color")
+        if g2.button("↩️ 查看全品类", key="btn_density_reset", use_container_width=True):
+            st.session_state.pending_filter = (min_p, max_p, 0)
+            st.rerun()
+        if not filtered_df.empty:
+            density_fig, density_raw = build_density_figure(
+                view_key, density_color, filtered_df['Clean_Price'].to_numpy(), filtered_df['Clean_Sales'].to_numpy(),
+                filtered_df['GMV'].to_numpy(), filtered_df['Product_Id'].to_numpy(), filtered_df[col_name].astype(str).to_numpy())
+            st.caption(f"{'原始点' if density_raw else '分箱密度'} · 当前窗口 {len(filtered_df):,} 个商品"
+                       + ("" if density_raw else f" (≤ {DENSITY_RAW_LIMIT:,} 个时显示原始点)"))
+            density_event = st.plotly_chart(density_fig, use_container_width=True, on_select="rerun",
+                                            selection_mode=("points", "box"), key="density_chart")
+            density_sel = density_event['selection'] if density_event else None
+            sel_sig = json.dumps(density_sel, sort_keys=True, default=str) if density_sel else None
+            # 选区状态会跨 rerun 保留, 只处理新出现的选区, 避免和侧边栏滑块来回打架
+            if density_sel and sel_sig != st.session_state.density_handled_sel and (density_sel['box'] or density_sel['points']):
+                st.session_state.density_handled_sel = sel_sig
+                new_filter = density_selection_filter(density_sel, density_raw)
+                if new_filter:
+                    st.session_state.pending_filter = new_filter
+                    st.rerun()
+                elif density_raw and density_sel['points']:
+                    select_product(int(density_sel['points'][0]['customdata'][0]))
         st.markdown('</div>', unsafe_allow_html=True)
     st.markdown("<br>", unsafe_allow_html=True)
+    rerun_timer.lap("全品类分布")
+
+    # --- 🧬 同款聚类 & 标题搜索 ---
+    with st.container():
+        st.markdown('<div class="glass-card">', unsafe_allow_html=True)
+        st.subheader("🧬 同款聚类 (多卖家重复上架合并统计)")
+        title_query = st.text_input("🔎 标题搜索 (全品类)", key="title_query", placeholder="输入关键词, 如 led lamp / 面膜")
+        cluster_cfg = {
+            "Title": st.column_config.TextColumn("标题", width="large"),
+            "Listings": st.column_config.NumberColumn("同款链接数"),
+            "Cluster_Sales": st.column_config.NumberColumn("同款合计销量", format="%.0f"),
+            "Cluster_GMV": st.column_config.NumberColumn("同款合计 GMV", format="$%.0f"),
+            "Price_Min": st.column_config.NumberColumn("最低价", format="$%.2f"),
+            "Price_Max": st.column_config.NumberColumn("最高价", format="$%.2f"),
+            "Clean_Price": st.column_config.NumberColumn("售价", format="$%.2f"),
+            "Clean_Sales": st.column_config.NumberColumn("销量"),
+            "GMV": st.column_config.NumberColumn("GMV", format="$%.0f"),
+        }
+        if title_query.strip():
+            t0 = time.perf_counter()
+            hit_pos, _ = search_titles(title_index, title_query, rank_index["gmv_rank"])
+            st.caption(f"命中 {len(hit_pos)} 条 (最多显示 {TITLE_SEARCH_LIMIT}) · {(time.perf_counter() - t0) * 1000:.0f} ms / {title_index['n']:,} 个标题")
+            cluster_table = main_df.iloc[hit_pos][[col_name, 'Clean_Price', 'Clean_Sales', 'GMV', 'Product_Id']].rename(columns={col_name: 'Title'})
+            cluster_table['Listings'] = title_index["cluster_size"][hit_pos]
+        else:
+            cluster_table = st.session_state.cluster_view_rollup
+            st.caption(f"当前筛选池 {len(filtered_df):,} 条链接 → {st.session_state.cluster_view_count:,} 款独立商品 (与代表标题相似度 ≥ {DEDUP_MIN_JACCARD:.0%}, 短标题 ≥ {DEDUP_SHORT_JACCARD:.0%}, 型号/规格数字一致才视为同款)")
+        cluster_sel = st.dataframe(cluster_table.drop(columns='Product_Id'), column_config=cluster_cfg, hide_index=True,
+                                   use_container_width=True, height=260, on_select="rerun", selection_mode="single-row", key="cluster_table")
+        # 表格选中行会跨 rerun 保留, 只处理新选中的行 (取消选中也记下), 否则会盖掉之后 Top3/柱状图的点选
+        cluster_sig = (title_query.strip(), tuple(cluster_sel.selection["rows"]))
+        if cluster_sig != st.session_state.cluster_handled_sel:
+            st.session_state.cluster_handled_sel = cluster_sig
+            if cluster_sel.selection["rows"]: select_product(int(cluster_table['Product_Id'].iat[cluster_sel.selection["rows"][0]]))
+        st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown("<br>", unsafe_allow_html=True)
+    rerun_timer.lap("同款聚类")
 
     # List
-    display_cols = [col_name, 'Clean_Price', 'Clean_Sales', 'GMV']
+    display_cols = [col_name, 'Clean_Price', 'Clean_Sales', 'GMV', 'Profit', 'Margin', 'Profit_GMV']
     if has_image: display_cols.insert(0, 'Image_Url')
+    if has_trend: display_cols += ['Sales_Velocity', 'GMV_Delta']
     col_config = {
         col_name: st.column_config.TextColumn("标题", width="medium"),
         "Clean_Price": st.column_config.NumberColumn("售价", format="$%.2f"),
         "Clean_Sales": st.column_config.NumberColumn("销量"),
         "GMV": st.column_config.NumberColumn("GMV", format="$%.0f"),
+        "Sales_Velocity": st.column_config.NumberColumn("日均销量增速", format="%.1f"),
+        "GMV_Delta": st.column_config.NumberColumn("GMV 变化", format="$%.0f"),
+        "Profit": st.column_config.NumberColumn("预估利润", format="$%.2f"),
+        "Margin": st.column_config.NumberColumn("利润率", format="%.1f%%"),
+        "Profit_GMV": st.column_config.NumberColumn("利润 GMV", format="$%.0f", help="单件利润 × 销量"),
     }
     if has_image: col_config["Image_Url"] = st.column_config.ImageColumn("主图", help="点击放大")
 
-    st.subheader("📋 商品清单 (点击选择)")
+    l1, l2 = st.columns([3, 1])
+    l1.subheader("📋 商品清单 (点击选择)")
+    list_sort = l2.selectbox("排序", list(LIST_SORT_OPTIONS), key="list_sort")
+    list_df = filtered_df
+    if LIST_SORT_OPTIONS[list_sort] != "GMV":
+        list_df = filtered_df.iloc[np.argsort(-filtered_df[LIST_SORT_OPTIONS[list_sort]].to_numpy(), kind='stable')]
     selection = st.dataframe(
-        filtered_df.sort_values('GMV', ascending=False)[display_cols],
+        list_df[display_cols],
         column_config=col_config, use_container_width=True, height=300,
         on_select="rerun", selection_mode="single-row"
     )
+    rerun_timer.lap("清单序列化")
 
     current_product = None
-    if selection.selection["rows"]:
-        current_product = filtered_df.sort_values('GMV', ascending=False).iloc[selection.selection["rows"][0]]
-        if st.session_state.selected_product_title != current_product[col_name]:
-            st.session_state.gen_keywords = ""
-            st.session_state.gen_title = ""
-            st.session_state.gen_desc = ""
-        st.session_state.selected_product_title = current_product[col_name]
-    elif st.session_state.selected_product_title:
-        match = filtered_df[filtered_df[col_name] == st.session_state.selected_product_title]
-        if not match.empty: current_product = match.iloc[0]
+    list_sig = (view_key, list_sort, tuple(selection.selection["rows"]))
+    if list_sig != st.session_state.list_handled_sel:
+        st.session_state.list_handled_sel = list_sig
+        if selection.selection["rows"]: select_product(int(list_df['Product_Id'].iat[selection.selection["rows"][0]]))
+    if st.session_state.selected_product_id is not None:
+        product_pos = lookup_product_pos(rank_index, st.session_state.selected_product_id)
+        if product_pos is not None:
+            row = main_df.iloc[product_pos]
+            # 只在当前筛选池内展示, 与清单保持一致
+            if (price_range[0] <= row['Clean_Price'] <= price_range[1] and row['Clean_Sales'] >= sales_min
+                    and (margin_min <= -100 or row['Margin'] >= margin_min)): current_product = row
 
     st.markdown("<div id='analysis_target'></div>", unsafe_allow_html=True)
     if current_product is not None:
@@ -299,6 +1212,10 @@ if uploaded_file:
             st.markdown('<div class="glass-card">', unsafe_allow_html=True)
             if has_image and pd.notna(current_product['Image_Url']):
                 st.markdown(f'<img src="{current_product["Image_Url"]}" style="width:100%; border-radius:12px; max-height:250px; object-fit:contain;">', unsafe_allow_html=True)
+            history = load_product_history(current_product['Product_Key'], snapshot_rev)
+            if len(history) > 1:
+                st.caption("📈 历史销量走势")
+                st.line_chart(history.set_index('snapshot_date')['sales'], height=180)
             st.markdown('</div>', unsafe_allow_html=True)
 
         with c_mid:
@@ -306,9 +1223,10 @@ if uploaded_file:
             st.subheader("💰 利润模拟器")
             sell_price = current_product['Clean_Price']
             st.metric("零售价", f"${sell_price:.2f}")
-            cost_price = st.number_input("进货成本", value=float(sell_price)*0.2, step=1.0)
-            ship_cost = st.number_input("头程运费", value=3.0, step=0.5)
-            platform_fee = sell_price * 0.05 
+            # 默认值取侧边栏的利润规则, 单品可再手动微调
+            cost_price = st.number_input("进货成本", value=float(sell_price) * profit_rules[0], step=1.0)
+            ship_cost = st.number_input("头程运费", value=float(shipping_cost(sell_price, profit_rules[2])), step=0.5)
+            platform_fee = sell_price * profit_rules[1]
             profit = sell_price - cost_price - ship_cost - platform_fee
             margin = (profit / sell_price) * 100 if sell_price > 0 else 0
             st.markdown("---")
@@ -321,18 +1239,32 @@ if uploaded_file:
             st.markdown('<div class="glass-card">', unsafe_allow_html=True)
             st.subheader("🤖 AI 运营助手 (V3)")
             
+            ai_refresh = st.toggle("♻️ 重新生成 (跳过缓存)", value=False, help="默认相同提示词直接复用已生成的结果")
+            orig_name = str(current_product[col_name])
+
+            # --- 一键模式: 单次请求返回 JSON, 四个字段边流边填, 结果写回分步模式的状态 ---
+            if st.button("⚡ 一键生成全部 (单次请求)"):
+                if is_ai_ready:
+                    oneshot_slots = {field: st.empty() for field in ONESHOT_FIELDS}
+                    fields = stream_ai_fields(client, build_oneshot_prompt(orig_name), oneshot_slots, temp=ai_temp, refresh=ai_refresh)
+                    if fields:
+                        st.session_state.gen_keywords = fields.get("keywords", "")
+                        st.session_state.gen_title = fields.get("title", "")
+                        st.session_state.gen_desc = fields.get("description", "")
+                        st.session_state.gen_script = fields.get("script", "")
+                else: st.warning("请检查 API Key")
+
             tab1, tab2 = st.tabs(["核心文案 (SEO & 卖点)", "视频脚本"])
             
             with tab1:
-                orig_name = str(current_product[col_name])
                 st.caption(f"原标题: {orig_name[:50]}...")
                 
                 # --- 步骤 0: 关键词提取 ---
                 if st.button("🔍 0. 智能提炼关键词 (One-Click)"):
                     if is_ai_ready:
-                        prompt_kw = f"As a TikTok SEO expert, extract 5-8 high-traffic, relevant English keywords from this product title: '{orig_name}'. Output ONLY the keywords separated by commas, no other text."
+                        prompt_kw = build_keyword_prompt(orig_name)
                         placeholder_kw = st.empty()
-                        res = stream_ai_response(client, prompt_kw, placeholder_kw, temp=1.0)
+                        res = stream_ai_response(client, prompt_kw, placeholder_kw, temp=1.0, refresh=ai_refresh)
                         st.session_state.gen_keywords = res
                     else: st.warning("请检查 API Key")
                 
@@ -346,17 +1278,9 @@ if uploaded_file:
                 # --- 步骤 1: 标题生成 ---
                 if st.button("🚀 1. 生成裂变 SEO 标题"):
                     if is_ai_ready and keywords_in:
-                        prompt_title = f"""
-                        Act as a TikTok Shop copywriter. Create ONE optimized product title based on: "{orig_name}".
-                        Target Keywords: {keywords_in}.
-                        Rules:
-                        1. Length: Keep it between 40-80 characters (Mobile optimized).
-                        2. Structure: [Adjective/Hook] + [Core Product Name] + [Benefit/Feature] + [Emoji].
-                        3. Goal: High Click-Through Rate (CTR) and SEO friendly.
-                        4. Output ONLY the title, no explanations.
-                        """
+                        prompt_title = build_title_prompt(orig_name, keywords_in)
                         placeholder_t = st.empty() 
-                        st.session_state.gen_title = stream_ai_response(client, prompt_title, placeholder_t, temp=ai_temp)
+                        st.session_state.gen_title = stream_ai_response(client, prompt_title, placeholder_t, temp=ai_temp, refresh=ai_refresh)
                     elif not keywords_in: st.warning("请先提取或输入关键词！")
                     else: st.warning("API 未连接")
                 
@@ -368,19 +1292,9 @@ if uploaded_file:
                 # --- 步骤 2: 描述生成 ---
                 if st.button("📝 2. 生成高转化描述 (不凑字数)"):
                     if is_ai_ready and st.session_state.gen_title:
-                        prompt_desc = f"""
-                        Write a high-converting TikTok Shop product description for: "{st.session_state.gen_title}".
-                        Keywords: {keywords_in}.
-                        Structure (Strictly follow this):
-                        1. **Hook**: A short, punchy sentence to grab attention.
-                        2. **Pain Point & Solution**: Relate to a user problem and how this solves it.
-                        3. **Key Features**: 3-4 bullet points highlighting benefits (not just specs).
-                        4. **CTA**: Clear Call to Action (e.g., "Grab yours now!").
-                        Tone: Authentic, Exciting, Viral. English only. 
-                        Length: Concise, about 150-250 words. Do not write fluff.
-                        """
+                        prompt_desc = build_desc_prompt(st.session_state.gen_title, keywords_in)
                         placeholder_d = st.empty()
-                        st.session_state.gen_desc = stream_ai_response(client, prompt_desc, placeholder_d, temp=ai_temp)
+                        st.session_state.gen_desc = stream_ai_response(client, prompt_desc, placeholder_d, temp=ai_temp, refresh=ai_refresh)
                     elif not st.session_state.gen_title: st.warning("请先生成标题！")
 
             with tab2:
@@ -388,12 +1302,82 @@ if uploaded_file:
                 if st.button("🎬 生成爆款脚本"):
                     if is_ai_ready and keywords_in:
                         target = st.session_state.gen_title if st.session_state.gen_title else orig_name
-                        prompt_script = f"Write a TikTok video script for: {target}. Keywords: {keywords_in}. Style: User Generated Content (UGC) feel. Include: Visual Hook (0-3s), Problem Agitation, Product Demo, Social Proof, CTA."
+                        prompt_script = build_script_prompt(target, keywords_in)
                         placeholder_s = st.empty()
-                        stream_ai_response(client, prompt_script, placeholder_s, temp=ai_temp)
+                        st.session_state.gen_script = stream_ai_response(client, prompt_script, placeholder_s, temp=ai_temp, refresh=ai_refresh)
                     else: st.warning("请先设置关键词")
+                elif st.session_state.gen_script: st.markdown(st.session_state.gen_script)
 
             st.markdown('</div>', unsafe_allow_html=True)
+    rerun_timer.lap("分析室/AI")
+
+    # --- 🏭 批量文案: 对筛选池 GMV 前 N 名并发生成整套文案 ---
+    st.markdown("<br>", unsafe_allow_html=True)
+    with st.expander("🏭 批量生成 Top N 文案 (关键词 → 标题 → 描述 → 脚本)", expanded=False):
+        b1, b2, b3, b4 = st.columns(4)
+        batch_n = b1.number_input("商品数 (按 GMV)", min_value=1, max_value=200, value=20)
+        batch_workers = b2.number_input("并发数", min_value=1, max_value=16, value=4)
+        batch_rpm = b3.number_input("每分钟请求上限", min_value=1, max_value=600, value=60)
+        batch_retries = b4.number_input("失败重试次数", min_value=0, max_value=8, value=4)
+        batch_refresh = st.checkbox("♻️ 重新生成 (跳过缓存)", key="batch_refresh")
+        if st.button("🚀 开始批量生成", key="btn_batch_copy"):
+            if not is_ai_ready: st.warning("请检查 API Key")
+            else:
+                batch_df = filtered_df.head(int(batch_n))
+                products = list(zip(batch_df['Product_Id'].astype(int).tolist(), batch_df[col_name].astype(str).tolist()))
+                st.session_state.batch_results = []
+                batch_bar = st.progress(0.0, text=f"0 / {len(products)}")
+                batch_table = st.empty()
+                for row in run_batch_copy(client, products, ai_temp, get_llm_cache(), int(batch_workers), int(batch_rpm), int(batch_retries), batch_refresh):
+                    st.session_state.batch_results.append(row)
+                    done = len(st.session_state.batch_results)
+                    batch_bar.progress(done / len(products), text=f"{done} / {len(products)}")
+                    batch_table.dataframe(pd.DataFrame(st.session_state.batch_results), use_container_width=True, height=300)
+                batch_bar.empty(); batch_table.empty()
+        if st.session_state.batch_results:
+            results_df = pd.DataFrame(st.session_state.batch_results)
+            st.dataframe(results_df, use_container_width=True, height=300)
+            d1, d2 = st.columns(2)
+            d1.download_button("⬇️ 导出 CSV", results_df.to_csv(index=False).encode("utf-8-sig"), file_name="tk_batch_copy.csv", mime="text/csv")
+            d2.download_button("⬇️ 导出 Excel", results_to_xlsx_bytes(results_df), file_name="tk_batch_copy.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    rerun_timer.lap("批量文案")
+    rerun_timer.note_frame("main_df", main_df)
+    rerun_timer.note_frame("filtered_df", filtered_df)
 
 else:
-    st.markdown('<div class="glass-card" style="text-align: center; padding: 60px;"><h2>👈 请上传数据表格</h2></div>', unsafe_allow_html=True)
\ No newline at end of file
+    st.markdown('<div class="glass-card" style="text-align: center; padding: 60px;"><h2>👈 请上传数据表格</h2></div>', unsafe_allow_html=True)
+
+# ==========================================
+# 5. 性能面板 (Boss)
+# ==========================================
+rerun_timer.finish()
+if st.session_state.active_profiler is not None:
+    st.session_state.active_profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_path = os.path.join(PROFILE_DIR, f"rerun-{datetime.datetime.now():%Y%m%d-%H%M%S}.prof")
+    st.session_state.active_profiler.dump_stats(profile_path)
+    profile_summary = io.StringIO()
+    pstats.Stats(st.session_state.active_profiler, stream=profile_summary).sort_stats("cumulative").print_stats(25)
+    st.session_state.last_profile = (profile_path, profile_summary.getvalue())
+    st.session_state.active_profiler = None
+
+if perf_panel is not None:
+    with perf_panel.expander("⏱️ 本轮耗时分析", expanded=False):
+        perf_runs = pd.DataFrame(list(get_perf_history())) * 1000
+        st.metric("本轮合计", f"{rerun_timer.stages['整轮合计'] * 1000:.0f} ms")
+        for label, value in rerun_timer.stats.items(): st.caption(f"{label}: {value:,}")
+        st.dataframe(pd.DataFrame({
+            "本轮(ms)": pd.Series(rerun_timer.stages) * 1000,
+            "p50(ms)": perf_runs.quantile(0.5), "p95(ms)": perf_runs.quantile(0.95),
+        }).round(1), height=360)
+        st.caption(f"最近 {len(perf_runs)} 轮 rerun")
+        if st.button("📸 对下一轮做 cProfile", key="btn_profile_rerun"):
+            st.session_state.profile_next_rerun = True
+            st.rerun()
+        if st.session_state.get('last_profile'):
+            profile_path, profile_text = st.session_state.last_profile
+            st.code(profile_text[:6000], language="text")
+            if os.path.exists(profile_path):
+                with open(profile_path, "rb") as f:
+                    st.download_button("⬇️ 下载 .prof", f.read(), file_name=os.path.basename(profile_path))
\ No newline at end of file